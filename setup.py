@@ -67,6 +67,7 @@ PACKAGES = [
     "shadow4.beamline.optical_elements.mirrors",
     "shadow4.beamline.optical_elements.crystals",
     "shadow4.beamline.optical_elements.gratings",
+    "shadow4.tools",
 ]
 
 INSTALL_REQUIRES = (
@@ -17,28 +17,140 @@ class Beam(object):
 
     """
 
-    def __init__(self, N=1000, array=None):
+    # the source columns (1-18) used by the derived columns that are memoized by get_column()
+    _DERIVED_COLUMNS_SOURCES = {
+        19: (11,),
+        20: (1, 2, 3),
+        21: (5,),
+        22: (7, 8, 9, 16, 17, 18),
+        23: (7, 8, 9, 16, 17, 18),
+        24: (7, 8, 9),
+        25: (16, 17, 18),
+        26: (11,),
+        27: (4, 11),
+        28: (5, 11),
+        29: (6, 11),
+        30: (7, 8, 9, 16, 17, 18),
+        31: (7, 8, 9, 16, 17, 18),
+        32: (7, 8, 9, 14, 15, 16, 17, 18),
+        33: (7, 8, 9, 14, 15, 16, 17, 18),
+        34: (7, 8, 9, 11, 16, 17, 18),
+        35: (4,),
+        36: (6,),
+    }
+
+    # number of rays transformed at once by apply_transform()
+    _TRANSFORM_BLOCK_SIZE = 100000
+
+    # the columns that can be stored in single precision in files (see write_h5):
+    # electric vectors (s and p), flag and ray index
+    _SINGLE_PRECISION_COLUMNS = (7, 8, 9, 10, 12, 16, 17, 18)
+
+    def __init__(self, N=1000, array=None, column_major=False):
         """
 
         :param N:
         :param array:
+        :param column_major: if True, the rays array is stored by columns (Fortran order), so each column is
+                             contiguous in memory and the column-wise operations are faster.
         :return:
         """
+        self._column_major = column_major
         if array is not None:
             N, ncol = array.shape
             if ncol != 18:
                 raise Exception ("Bad array shape: must be (npoints,18)")
-            self.rays = array.copy()
+            self.rays = numpy.array(array, order=self._get_order())
         else:
-            self.rays = numpy.zeros((N,18))
+            self.rays = numpy.zeros((N,18), order=self._get_order())
+
+        self._loss_record = None
+
+    @property
+    def rays(self):
+        return self._rays
+
+    @rays.setter
+    def rays(self, value):
+        if self._column_major:
+            value = numpy.asfortranarray(value)
+        self._rays = value
+        self.invalidate_cache()
+
+    def _get_order(self):
+        return "F" if self._column_major else "C"
+
+    def is_column_major(self):
+        """
+
+        Returns
+        -------
+        True if the rays are stored by columns
+        """
+        return self._column_major
+
+    def set_column_major(self, column_major=True):
+        """
+        Changes (if needed) the memory layout of the rays array: by columns (column_major=True) or by rays.
+
+        Parameters
+        ----------
+        column_major
+
+        Returns
+        -------
+
+        """
+        if column_major != self._column_major:
+            self._column_major = column_major
+            self.rays = numpy.array(self.rays, order=self._get_order())
+
+    def invalidate_cache(self):
+        """
+        Discards the memoized derived columns. The Beam methods that modify the rays call it, it must be
+        called only after modifying the rays array directly (e.g. beam.rays[:,0] += 1.0).
+
+        Returns
+        -------
+
+        """
+        self._derived_columns = {}
+        self._nolost_masks = {}
+
+    def _invalidate_columns(self, columns):
+        # discards the memoized derived columns (and lost ray masks) that depend on the given source columns
+        for column in list(self._derived_columns):
+            if not set(self._DERIVED_COLUMNS_SOURCES[column]).isdisjoint(columns):
+                del self._derived_columns[column]
+        if 10 in columns:
+            self._nolost_masks = {}
+
+    def _get_nolost_mask(self, nolost):
+        # returns the (read only) mask of the good (nolost=1) or lost (nolost=2) rays, calculated only once
+        mask = self._nolost_masks.get(nolost)
+        if mask is None:
+            if nolost == 1:
+                mask = self.rays[:,9] > 0.0
+            else:
+                mask = self.rays[:,9] < 0.0
+            mask.flags.writeable = False
+            self._nolost_masks[nolost] = mask
+        return mask
 
     @classmethod
-    def initialize_from_array(cls, array):
+    def _read_only(cls, array):
+        out = array.view()
+        out.flags.writeable = False
+        return out
+
+    @classmethod
+    def initialize_from_array(cls, array, column_major=False):
         """
 
         Parameters
         ----------
         array
+        column_major: if True, the rays are stored by columns
 
         Returns
         -------
@@ -46,7 +158,7 @@ class Beam(object):
         """
         if array.shape[1] != 18:
             raise Exception("Bad array shape: must be (npoints,18)")
-        return Beam(array=array)
+        return Beam(array=array, column_major=column_major)
 
     @classmethod
     def initialize_as_pencil(cls, N=1000):
@@ -77,7 +189,9 @@ class Beam(object):
         -------
 
         """
-        return Beam.initialize_from_array(self.rays.copy())
+        beam = Beam.initialize_from_array(self.rays, column_major=self._column_major)
+        beam._loss_record = self._loss_record
+        return beam
 
     #
     # getters
@@ -165,7 +279,7 @@ class Beam(object):
             w = self.get_column(25, nolost=nolost)
         return w.sum()
 
-    def get_column(self,column,nolost=0):
+    def get_column(self,column,nolost=0,copy=True):
         """
 
         Parameters
@@ -215,6 +329,8 @@ class Beam(object):
             -11: column 26
 
         nolost
+        copy: if False, a read only array is returned, which is a view of the beam data (not a copy) when
+              all the rays are selected. Use it only for reading: it may change if the beam is modified.
 
         Returns
         -------
@@ -225,50 +341,9 @@ class Beam(object):
 
         if column <= 18:
             out = self.rays[:,column-1]
+        elif column in self._DERIVED_COLUMNS_SOURCES:
+            out = self._get_derived_column(column)
         else:
-            A2EV = 2.0*numpy.pi/(codata.h*codata.c/codata.e*1e2)
-            column_index = column - 1
-            ray = self.rays
-
-             # if colu mn_index==10: out =  ray[:,column_index]/A2EV
-            if column == 19: out =  2*numpy.pi*1.0e8/ray[:,10]
-            if column == 20: out =  numpy.sqrt(ray[:,0]*ray[:,0]+ray[:,1]*ray[:,1]+ray[:,2]*ray[:,2])
-            if column == 21: out =  numpy.arccos(ray[:,4])
-            if column == 22: out =  numpy.sqrt(numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0))
-            if column == 23: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0)
-            if column == 24: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-            if column == 25: out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-            if column == 26: out =  ray[:,10]/A2EV
-            if column == 27: out =  ray[:,3]*ray[:,10]*1.0e8
-            if column == 28: out =  ray[:,4]*ray[:,10]*1.0e8
-            if column == 29: out =  ray[:,5]*ray[:,10]*1.0e8
-            if column == 30:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                out =  E2p+E2s
-            if column ==31:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                out =  E2p-E2s
-            if column == 32:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                Cos = numpy.cos(ray[:,13]-ray[:,14])
-                out =  2*numpy.sqrt(E2s*E2p)*Cos
-            if column == 33:
-                E2s = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8] ]),axis=0)
-                E2p = numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [15,16,17] ]),axis=0)
-                Sin = numpy.sin(ray[:,13]-ray[:,14])
-                out =  2*numpy.sqrt(E2s*E2p)*Sin
-
-            if column == 34:
-                out =  numpy.sum(numpy.array([ ray[:,i]*ray[:,i] for i in [6,7,8,15,16,17] ]),axis=0) *\
-                ray[:,10]/A2EV
-
-            if column == 35:
-                out = numpy.abs(numpy.arcsin(ray[:,3]))
-            if column == 36:
-                out = numpy.abs(numpy.arcsin(ray[:,5]))
             if column == 37:
                 f = self.getshonecol(10)
                 w = self.getshonecol(23)
@@ -302,39 +377,96 @@ class Beam(object):
 
 
         if nolost == 0:
-            return out.copy()
+            if copy:
+                return out.copy()
+            return self._read_only(out)
 
-        if nolost == 1:
-            f  = numpy.where(self.rays[:,9] > 0.0)
-            if len(f[0])==0:
+        f = self._get_nolost_mask(nolost)
+        if not f.any():
+            if nolost == 1:
                 print ('Beam.get_column: no GOOD rays, returning empty array')
-                return numpy.empty(0)
-            return out[f].copy()
-
-        if nolost == 2:
-            f  = numpy.where(self.rays[:,9] < 0.0)
-            if len(f[0])==0:
+            else:
                 print ('Beam.get_column: no BAD rays, returning empty array')
-                return numpy.empty(0)
-            return out[f].copy()
+            return numpy.empty(0)
+        if not copy and f.all():
+            return self._read_only(out)
+        return out[f]
+
+    def _get_derived_column(self, column):
+        # returns the (read only) derived column for all rays, calculated only once
+        out = self._derived_columns.get(column)
+        if out is not None:
+            return out
 
-    def get_columns(self,columns,nolost=0):
+        A2EV = 2.0*numpy.pi/(codata.h*codata.c/codata.e*1e2)
+        ray = self.rays
+
+        if column == 19: out = 2*numpy.pi*1.0e8/ray[:,10]
+        if column == 20: out = numpy.sqrt(ray[:,0]*ray[:,0]+ray[:,1]*ray[:,1]+ray[:,2]*ray[:,2])
+        if column == 21: out = numpy.arccos(ray[:,4])
+        # intensity and Stokes family: all of them from |Es|^2 and |Ep|^2
+        if column == 22: out = numpy.sqrt(self._get_derived_column(23))
+        if column == 23: out = self._get_derived_column(24) + self._get_derived_column(25)
+        if column == 24: out = numpy.einsum('ij,ij->i', ray[:,6:9], ray[:,6:9])
+        if column == 25: out = numpy.einsum('ij,ij->i', ray[:,15:18], ray[:,15:18])
+        if column == 26: out = ray[:,10]/A2EV
+        if column == 27: out = ray[:,3]*ray[:,10]*1.0e8
+        if column == 28: out = ray[:,4]*ray[:,10]*1.0e8
+        if column == 29: out = ray[:,5]*ray[:,10]*1.0e8
+        if column == 30: out = self._get_derived_column(23)
+        if column == 31: out = self._get_derived_column(25) - self._get_derived_column(24)
+        if column == 32: out = 2*numpy.sqrt(self._get_derived_column(24)*self._get_derived_column(25))*numpy.cos(ray[:,13]-ray[:,14])
+        if column == 33: out = 2*numpy.sqrt(self._get_derived_column(24)*self._get_derived_column(25))*numpy.sin(ray[:,13]-ray[:,14])
+        if column == 34: out = self._get_derived_column(23)*self._get_derived_column(26)
+        if column == 35: out = numpy.abs(numpy.arcsin(ray[:,3]))
+        if column == 36: out = numpy.abs(numpy.arcsin(ray[:,5]))
+
+        out.flags.writeable = False
+        self._derived_columns[column] = out
+        return out
+
+    def get_columns(self,columns,nolost=0,copy=True):
         """
 
         Parameters
         ----------
         columns
         nolost
+        copy: if False, a read only array is returned. For consecutive columns in 1-18 of all the rays
+              (e.g. [1,2,3]) it is a view of the beam data.
 
         Returns
         -------
 
         """
+        if isinstance(columns, int): return self.get_column(columns,nolost=nolost,copy=copy)
+
+        if not copy and nolost == 0 and len(columns) > 0 and 1 <= columns[0] and columns[-1] <= 18 and \
+                list(columns) == list(range(columns[0], columns[0] + len(columns))):
+            return self._read_only(self.rays[:,columns[0]-1:columns[-1]].T)
+
         ret = []
-        if isinstance(columns, int): return self.get_column(columns,nolost=nolost)
         for c in columns:
-            ret.append(self.get_column(c,nolost=nolost))
-        return numpy.array(tuple(ret))
+            ret.append(self.get_column(c,nolost=nolost,copy=False))
+        out = numpy.array(tuple(ret))
+        if not copy:
+            out.flags.writeable = False
+        return out
+
+    def view(self, nolost=0):
+        """
+        Returns a BeamView: read only access to the columns of all (nolost=0), good (nolost=1) or lost (nolost=2)
+        rays, without copying the beam data.
+
+        Parameters
+        ----------
+        nolost: 0: all rays  1: good rays, 2: bad rays
+
+        Returns
+        -------
+        BeamView instance
+        """
+        return BeamView(self, nolost=nolost)
 
 
 
@@ -760,6 +892,7 @@ class Beam(object):
         """
 
         self.rays[:,column-1] = value
+        self._invalidate_columns([column])
 
     def set_photon_energy_eV(self,energy_eV):
         """
@@ -774,6 +907,7 @@ class Beam(object):
         """
         A2EV = 2.0*numpy.pi/(codata.h*codata.c/codata.e*1e2)
         self.rays[:,10] = energy_eV * A2EV
+        self._invalidate_columns([11])
 
     def set_photon_wavelength(self,wavelength):
         """
@@ -787,6 +921,7 @@ class Beam(object):
 
         """
         self.rays[:,10] =  2*numpy.pi/(wavelength * 1e2)
+        self._invalidate_columns([11])
 
 
     #
@@ -851,6 +986,7 @@ class Beam(object):
             # TODO: modify optical path
             #
             self.rays[:,12] += tof
+            self._invalidate_columns([1,2,3,13])
 
         except AttributeError:
             print ('Beam.retrace: No rays')
@@ -873,17 +1009,45 @@ class Beam(object):
         if numpy.array(qdist1).size != 3:
             raise Exception("Input must be a vector [x,y,z]")
 
-        self.rays[:,0] += qdist1[0]
-        self.rays[:,1] += qdist1[1]
-        self.rays[:,2] += qdist1[2]
+        self.apply_transform(translation=qdist1)
 
         #
         # TODO: update optical path and may be phases of electric vectors
         #
 
+    def apply_transform(self, matrix=None, translation=None):
+        """
+        Transforms the beam in place: applies a 3x3 matrix (a rotation or a product of rotations) to the
+        positions, directions and electric vectors (s and p), and then adds a translation to the positions.
 
-    def rotate(self,theta,axis=1,rad=True):
+        Parameters
+        ----------
+        matrix: the (3,3) matrix acting on the column vectors [x,y,z] (default=None: no rotation)
+        translation: the translation vector [x,y,z] (default=None: no translation)
+
+        Returns
+        -------
+
+        """
+        if matrix is not None:
+            matrix = numpy.asarray(matrix, dtype=float)
+            if matrix.shape != (3,3):
+                raise Exception("Input must be a (3,3) matrix")
+            # by blocks of rays, to keep the temporary arrays small
+            for i0 in range(0, self.rays.shape[0], self._TRANSFORM_BLOCK_SIZE):
+                rays = self.rays[i0:i0+self._TRANSFORM_BLOCK_SIZE]
+                for i in [0,3,6,15]: # position, direction, Es, Ep
+                    rays[:,i:i+3] = numpy.dot(rays[:,i:i+3], matrix.T)
+
+        if translation is not None:
+            self.rays[:,0:3] += numpy.asarray(translation, dtype=float)
+
+        self.invalidate_cache()
+
+    @classmethod
+    def get_rotation_matrix(cls, theta, axis=1, rad=True):
         """
+        Returns the matrix used by rotate() for a scalar angle.
 
         Parameters
         ----------
@@ -894,42 +1058,72 @@ class Beam(object):
 
         Returns
         -------
-
+        numpy array (3,3)
         """
-
-
         if rad:
             theta1 = theta
         else:
             theta1 = theta * numpy.pi / 180
 
-        a1 = self.rays.copy()
+        costh = numpy.cos(theta1)
+        sinth = numpy.sin(theta1)
+
+        i, j = cls._rotated_axes(axis)
+        matrix = numpy.eye(3)
+        matrix[i,i] = costh
+        matrix[i,j] = sinth
+        matrix[j,i] = -sinth
+        matrix[j,j] = costh
+        return matrix
 
+    @classmethod
+    def _rotated_axes(cls, axis):
         if axis == 1:
-            torot = [2,3]
+            return 1, 2
         elif axis == 2:
-            torot = [1,3]
+            return 0, 2
         elif axis == 3:
-            torot = [1,2]
+            return 0, 1
+        else:
+            raise Exception("Axis must be 1, 2 or 3")
 
+    def rotate(self,theta,axis=1,rad=True):
+        """
 
-        costh = numpy.cos(theta1)
-        sinth = numpy.sin(theta1)
+        Parameters
+        ----------
+        theta: the rotation angle in degrees or radiants (default=0). It can be an array with an angle per ray.
+        axis: The axis number (Shadow's column) for the rotation
+                    (i.e, 1:x (default), 2:y, 3:z)
+        rad: set True if theta1 is in radiants (default)
 
-        tstart = numpy.array([1,4,7,16])
+        Returns
+        -------
 
-        for i in range(len(tstart)):
+        """
 
-            newaxis = axis + tstart[i] - 1
-            newaxisi = newaxis - 1
-            newtorot = torot + tstart[i] - 1
-            newtoroti = newtorot - 1
+        if numpy.ndim(theta) == 0:
+            self.apply_transform(self.get_rotation_matrix(theta, axis=axis, rad=rad))
+            return
 
-            self.rays[:,newtoroti[0]] =  a1[:,newtoroti[0]] * costh + a1[:,newtoroti[1]] * sinth
-            self.rays[:,newtoroti[1]] = -a1[:,newtoroti[0]] * sinth + a1[:,newtoroti[1]] * costh
-            self.rays[:,newaxisi]     =  a1[:,newaxisi]
+        # an angle per ray
+        if rad:
+            theta1 = theta
+        else:
+            theta1 = theta * numpy.pi / 180
 
-    def change_to_image_reference_system(self, theta, T_IMAGE, rad=True):
+        costh = numpy.cos(theta1)
+        sinth = numpy.sin(theta1)
+
+        i, j = self._rotated_axes(axis)
+        for start in [0,3,6,15]: # position, direction, Es, Ep
+            a1 = self.rays[:,start+i].copy()
+            self.rays[:,start+i] =  a1 * costh + self.rays[:,start+j] * sinth
+            self.rays[:,start+j] = -a1 * sinth + self.rays[:,start+j] * costh
+
+        self.invalidate_cache()
+
+    def change_to_image_reference_system(self, theta, T_IMAGE, rad=True, verbose=1):
         """
         Implements the propagation from the mirror reference frame to the screen (image) reference.
         Mimics IMREF and IMAGE1 subrutines in shadow3
@@ -939,6 +1133,7 @@ class Beam(object):
         theta: the grazing angle in rad or deg
         T_IMAGE: the distance o.e. to image
         rad: True is angle is in rad
+        verbose: set to 0 to not print the reflection angle
 
         Returns
         -------
@@ -952,69 +1147,36 @@ class Beam(object):
 
         T_REFLECTION = numpy.pi / 2 - theta1
 
-        a1 = self.rays.copy()
-
-        print(">>>>> rotate_imref T_REFLECTION = ", T_REFLECTION, T_REFLECTION * 180 / numpy.pi)
+        if verbose:
+            print(">>>>> rotate_imref T_REFLECTION = ", T_REFLECTION, T_REFLECTION * 180 / numpy.pi)
 
-        nrays = self.rays.shape[0]
-        UXIM_x = numpy.ones(nrays)
-        UXIM_y = numpy.zeros(nrays)
-        UXIM_z = numpy.zeros(nrays)
-
-        VZIM_x = numpy.zeros(nrays)
-        VZIM_y = numpy.zeros(nrays) - numpy.cos(T_REFLECTION)
-        VZIM_z = numpy.zeros(nrays) + numpy.sin(T_REFLECTION)
-
-        VNIMAG_x = numpy.zeros(nrays)
-        VNIMAG_y = numpy.zeros(nrays) + numpy.sin(T_REFLECTION)
-        VNIMAG_z = numpy.zeros(nrays) + numpy.cos(T_REFLECTION)
+        # the rows are the versors of the image plane: UXIM, VNIMAG and VZIM
+        matrix = numpy.array([[1.0, 0.0, 0.0],
+                              [0.0,  numpy.sin(T_REFLECTION), numpy.cos(T_REFLECTION)],
+                              [0.0, -numpy.cos(T_REFLECTION), numpy.sin(T_REFLECTION)]])
+        VNIMAG = matrix[1]
 
        # ABOVE = T_IMAGE - P_MIR(1) * C_STAR(1) - P_MIR(2) * C_STAR(2) - P_MIR(3) * C_STAR(3)
        # BELOW = C_STAR(1) * V_OUT(1) + C_STAR(2) * V_OUT(2) + C_STAR(3) * V_OUT(3)
 
-        ABOVE = T_IMAGE - a1[:,0] * VNIMAG_x - a1[:,1] * VNIMAG_y - a1[:,2] * VNIMAG_z
-        BELOW = VNIMAG_x * a1[:,3] + VNIMAG_y * a1[:,4] + VNIMAG_z * a1[:,5]
-
-
-        # IF (BELOW.NE.0.0D0) THEN
-        #    DIST	=   ABOVE/BELOW
-        # ELSE
-        #    RAY(10,J)  = - 3.0D6
-        #    GO TO 100
-        # END IF
+        ABOVE = T_IMAGE - (self.rays[:,0] * VNIMAG[0] + self.rays[:,1] * VNIMAG[1] + self.rays[:,2] * VNIMAG[2])
+        BELOW = self.rays[:,3] * VNIMAG[0] + self.rays[:,4] * VNIMAG[1] + self.rays[:,5] * VNIMAG[2]
 
         DIST = ABOVE / BELOW
-
-        failure = numpy.argwhere(BELOW == 0)
-        if len(failure) > 0:
-            a1[failure, 9] = -3.0e-6
+        del ABOVE, BELOW
 
         # ! ** Computes now the intersections onto TRUE image plane.
-
-        a1[:, 0]  +=   DIST * a1[:, 3]
-        a1[:, 1]  +=   DIST * a1[:, 4]
-        a1[:, 2]  +=   DIST * a1[:, 5]
+        for i in range(3):
+            self.rays[:,i] += DIST * self.rays[:,i+3]
 
         #!  ** Rotate now the results in the STAR (or TRUE image) reference plane.
         #!  ** Computes the projection of P_MIR onto the image plane versors.
-        #
-        RIMCEN_x = VNIMAG_x * T_IMAGE
-        RIMCEN_y = VNIMAG_y * T_IMAGE
-        RIMCEN_z = VNIMAG_z * T_IMAGE
-
-        a1[:, 0]  -=   RIMCEN_x
-        a1[:, 1]  -=   RIMCEN_y
-        a1[:, 2]  -=   RIMCEN_z
-
         #! ** Computes now the new vectors for the beam in the U,V,N ref.
-        for i in [1,4,7,16]: # position, direction, Es, Ep
-            # dot product
-            self.rays[:, i - 1 + 0] = a1[:, i - 1 + 0] * UXIM_x   + a1[:, i - 1 + 1] * UXIM_y   + a1[:, i - 1 + 2] * UXIM_z
-            self.rays[:, i - 1 + 1] = a1[:, i - 1 + 0] * VNIMAG_x + a1[:, i - 1 + 1] * VNIMAG_y + a1[:, i - 1 + 2] * VNIMAG_z
-            self.rays[:, i - 1 + 2] = a1[:, i - 1 + 0] * VZIM_x   + a1[:, i - 1 + 1] * VZIM_y   + a1[:, i - 1 + 2] * VZIM_z
+        self.apply_transform(matrix, translation=-numpy.dot(matrix, VNIMAG * T_IMAGE))
 
         # optical path col 13
         self.rays[:, 12] += numpy.abs(DIST)
+
     #
     # crop
     #
@@ -1054,7 +1216,7 @@ class Beam(object):
             if len(indices_out) > 0: window[indices_out] = 0
 
         flag[window < 1] = flag_lost_value
-        self.rays[:, 9] = flag
+        self.set_column(10, flag)
 
         return window
 
@@ -1100,7 +1262,7 @@ class Beam(object):
 
 
         flag[window < 1] = flag_lost_value
-        self.rays[:, 9] = flag
+        self.set_column(10, flag)
 
         return window
 
@@ -1155,7 +1317,7 @@ class Beam(object):
             if len(indices_out) > 0: window[indices_out] = 0
 
         flag[window < 1] = flag_lost_value
-        self.rays[:, 9] = flag
+        self.set_column(10, flag)
 
         return window
 
@@ -1255,6 +1417,7 @@ class Beam(object):
         self.rays[:, 6] *= Rs
         self.rays[:, 7] *= Rs
         self.rays[:, 8] *= Rs
+        self._invalidate_columns([7,8,9])
 
     def apply_reflectivity_p(self, Rp):
         """
@@ -1270,6 +1433,7 @@ class Beam(object):
         self.rays[:, 15] *= Rp
         self.rays[:, 16] *= Rp
         self.rays[:, 17] *= Rp
+        self._invalidate_columns([16,17,18])
 
     def apply_reflectivities(self, Rs, Rp):
         """
@@ -1287,6 +1451,101 @@ class Beam(object):
         self.apply_reflectivity_p(Rp)
 
 
+    #
+    # compaction of the lost rays
+    #
+    def compact(self, element=0):
+        """
+        Removes the lost rays (flag < 0) from the beam. They are archived in a loss record (ray index in the
+        full beam, element, flag, position) so that the full beam can be rebuilt with get_full_beam().
+
+        Parameters
+        ----------
+        element: the number of the element after which the rays are removed (stored in the loss record)
+
+        Returns
+        -------
+        the number of removed rays
+        """
+        lost = self._get_nolost_mask(2)
+        n_lost = int(numpy.count_nonzero(lost))
+
+        if n_lost == 0:
+            return 0
+
+        record = self._loss_record
+        if record is None:
+            N = self.rays.shape[0]
+            record = {"number_of_rays": N,
+                      "ray_index": numpy.arange(N),
+                      "index": numpy.zeros(0, dtype=int),
+                      "element": numpy.zeros(0, dtype=int),
+                      "flag": numpy.zeros(0),
+                      "position": numpy.zeros((0, 3)),
+                      }
+
+        ray_index = record["ray_index"]
+        self._loss_record = {
+            "number_of_rays": record["number_of_rays"],
+            "ray_index": ray_index[~lost],
+            "index": numpy.concatenate((record["index"], ray_index[lost])),
+            "element": numpy.concatenate((record["element"], numpy.full(n_lost, element, dtype=int))),
+            "flag": numpy.concatenate((record["flag"], self.rays[lost, 9])),
+            "position": numpy.concatenate((record["position"], self.rays[lost, 0:3])),
+            }
+        self.rays = self.rays[~lost]
+        return n_lost
+
+    def get_loss_record(self):
+        """
+        Returns the record of the rays removed by compact().
+
+        Returns
+        -------
+        None if the beam has never been compacted, otherwise a dict with:
+            "number_of_rays": the number of rays of the full beam,
+            "ray_index": the index in the full beam of each ray in the beam,
+            "index", "element", "flag", "position": index in the full beam, element number, flag and
+                                                    position (n,3) of each removed ray.
+        """
+        return self._loss_record
+
+    def set_loss_record(self, loss_record):
+        """
+        Sets the loss record (e.g. of the beam traced by an optical element that kept the rays of the
+        compacted input beam).
+
+        Parameters
+        ----------
+        loss_record: a dict as returned by get_loss_record(), or None
+
+        Returns
+        -------
+
+        """
+        if loss_record is not None and loss_record["ray_index"].size != self.rays.shape[0]:
+            raise Exception("The loss record does not correspond to the number of rays")
+        self._loss_record = loss_record
+
+    def get_full_beam(self):
+        """
+        Rebuilds the beam with all the rays, including the ones removed by compact(). For the removed rays
+        only the flag and the position are available (the other columns are zero).
+
+        Returns
+        -------
+        Beam instance
+        """
+        if self._loss_record is None:
+            return self.duplicate()
+
+        record = self._loss_record
+        beam = Beam(N=record["number_of_rays"], column_major=self._column_major)
+        beam.rays[record["ray_index"]] = self.rays
+        beam.rays[record["index"], 0:3] = record["position"]
+        beam.rays[record["index"], 9] = record["flag"]
+        return beam
+
     #
     #  interfaces like in shadow3
     #
@@ -1433,7 +1692,7 @@ class Beam(object):
             names[i] = "col%02d %s" % (i+1, names[i])
         return names
 
-    def write_h5(self,filename,overwrite=True,simulation_name="run001",beam_name="begin"):
+    def write_h5(self,filename,overwrite=True,simulation_name="run001",beam_name="begin",single_precision=False):
         """
 
         Parameters
@@ -1442,6 +1701,8 @@ class Beam(object):
         overwrite
         simulation_name
         beam_name
+        single_precision: if True, the electric vectors, the flag and the ray index are written in single
+                          precision (the other columns are always written in double precision).
 
         Returns
         -------
@@ -1476,7 +1737,7 @@ class Beam(object):
         f1.attrs['NX_class'] = 'NXentry'
         f1.attrs['default'] = "begin"
 
-        rays = self.get_rays()
+        rays = self.rays
 
         f2 = f1.create_group(beam_name)
         f2.attrs['NX_class'] = 'NXdata'
@@ -1489,14 +1750,17 @@ class Beam(object):
             column_name = column_names[i]
 
             # Y data
-            ds = f2.create_dataset(column_name, data=rays[:,i].copy())
+            if single_precision and (i+1) in self._SINGLE_PRECISION_COLUMNS:
+                ds = f2.create_dataset(column_name, data=rays[:,i].astype(numpy.float32))
+            else:
+                ds = f2.create_dataset(column_name, data=rays[:,i].copy())
             ds.attrs['long_name'] = "column %s"%(i+1)  # suggested X axis plot label
 
         f.close()
         print("File written/updated: %s"%filename)
 
     @classmethod
-    def load_h5(cls,filename,simulation_name="run001",beam_name="begin"):
+    def load_h5(cls,filename,simulation_name="run001",beam_name="begin",column_major=False):
         """
 
         Parameters
@@ -1504,6 +1768,7 @@ class Beam(object):
         filename
         simulation_name
         beam_name
+        column_major: if True, the rays of the returned beam are stored by columns
 
         Returns
         -------
@@ -1518,18 +1783,17 @@ class Beam(object):
         try:
             x = (f["%s/%s/col01 x"%(simulation_name,beam_name)])[:]
 
-            beam = Beam(N=x.size)
-            rays = numpy.zeros( (x.size,18))
+            beam = Beam(N=x.size, column_major=column_major)
             for i in range(18):
                 column_name = column_names[i]
-                rays[:,i] = (f["%s/%s/%s"%(simulation_name,beam_name,column_name)])[:]
+                beam.rays[:,i] = (f["%s/%s/%s"%(simulation_name,beam_name,column_name)])[:]
         except:
             f.close()
             raise Exception("Cannot find data in %s:/%s/%s" % (filename, simulation_name, beam_name))
 
         f.close()
 
-        return Beam.initialize_from_array(rays)
+        return beam
 
     def identical(self,beam2):
         """
@@ -1578,5 +1842,80 @@ class Beam(object):
 
 
 
+class BeamView(object):
+    """
+    Read only access to the columns of the rays of a Beam selected with nolost (see Beam.view()).
+
+    The columns are views of the beam data when all the rays are selected. Otherwise each column is extracted
+    only once and kept. The view is not updated if the beam is modified afterwards.
+    """
+    def __init__(self, beam, nolost=0):
+        self._beam = beam
+        self._nolost = nolost
+        self._columns = {}
+
+    def get_number_of_rays(self):
+        """
+
+        Returns
+        -------
+        number of selected rays
+        """
+        return self.get_column(10).size
+
+    def get_column(self, column):
+        """
+
+        Parameters
+        ----------
+        column: the column number (SHADOW convention, starting from 1, see Beam.get_column())
+
+        Returns
+        -------
+        read only array
+        """
+        if column == -11: column = 26
+        out = self._columns.get(column)
+        if out is None:
+            out = self._beam.get_column(column, nolost=self._nolost, copy=False)
+            self._columns[column] = out
+        return out
+
+    def get_columns(self, columns):
+        """
+
+        Parameters
+        ----------
+        columns: list of column numbers
+
+        Returns
+        -------
+        array (ncolumns, nrays)
+        """
+        return numpy.array([self.get_column(c) for c in columns])
+
+    def get_photon_energy_eV(self):
+        """
+
+        Returns
+        -------
+        read only array
+        """
+        return self.get_column(26)
+
+    def get_intensity(self, polarization=0):
+        """
+
+        Parameters
+        ----------
+        polarization: 0=total, 1=s, 2=p
+
+        Returns
+        -------
+
+        """
+        return self.get_column(23 + polarization).sum()
+
+
 if __name__ == "__main__":
     pass
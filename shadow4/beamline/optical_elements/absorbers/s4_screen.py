@@ -104,7 +104,7 @@ class S4ScreenElement(S4BeamlineElement):
                     flag[numpy.where(INSIDE)] = flag_lost_value
                 else:
                     flag[numpy.where(~INSIDE)] = flag_lost_value
-                beam.rays[:, 9] = flag
+                beam.set_column(10, flag)
 
             else:
                 print(">>>>>>>>>>>>  NO CROP !", shape)
@@ -119,19 +119,20 @@ class S4ScreenElement(S4BeamlineElement):
 
             if oe._file_abs != "":
                 try:
-                    pr = PreRefl()
-                    pr.read_preprocessor_file(oe._file_abs)
-                    print(pr.info())
+                    pr = PreRefl.create_from_preprocessor_file(oe._file_abs)
                 except:
                     raise Exception("Failed to load preprocessor (prerefl) file %s " % oe._file_abs)
 
-                energy = beam.get_column(26)
-                # tmp = pr.get_attenuation_coefficient(energy[0],verbose=1)
-                coeff = pr.get_attenuation_coefficient(energy)
-                I_over_I0 = numpy.exp(- coeff * thickness * 1e2)
-                sqrt_I_over_I0 = numpy.sqrt(I_over_I0)
-                print(energy, coeff, I_over_I0)
-                beam.apply_reflectivities(sqrt_I_over_I0, sqrt_I_over_I0)
+                # the attenuation is only calculated for the rays not lost (upstream or in the crop)
+                alive = numpy.where(beam.rays[:, 9] > 0)[0]
+                if alive.size > 0:
+                    energy = beam.get_column(26)[alive]
+                    # tmp = pr.get_attenuation_coefficient(energy[0],verbose=1)
+                    coeff = pr.get_attenuation_coefficient(energy)
+                    I_over_I0 = numpy.exp(- coeff * thickness * 1e2)
+                    sqrt_I_over_I0 = numpy.ones(beam.rays.shape[0])
+                    sqrt_I_over_I0[alive] = numpy.sqrt(I_over_I0)
+                    beam.apply_reflectivities(sqrt_I_over_I0, sqrt_I_over_I0)
 
 
         if q != 0.0:
@@ -5,7 +5,9 @@ from shadow4.syned.shape import Rectangle
 from shadow4.syned.element_coordinates import ElementCoordinates
 from syned.beamline.optical_elements.mirrors.mirror import Mirror
 
+from shadow4.beam.beam import Beam
 from shadow4.physical_models.prerefl.prerefl import PreRefl
+from shadow4.tools.cache import load_table, load_cached
 
 class S4Mirror(Mirror):
 
@@ -82,54 +84,68 @@ class S4MirrorElement(S4BeamlineElement):
 
         #
         # put beam in mirror reference system
+        # (the rotations around Y (alpha1) and X (theta_grazing1) and the translation are applied in one pass,
+        # to all the rays, so the lost ones are also in the mirror frame)
         #
-        beam.rotate(alpha1, axis=2)
-        beam.rotate(theta_grazing1, axis=1)
-        beam.translation([0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+        beam.apply_transform(numpy.dot(Beam.get_rotation_matrix(theta_grazing1, axis=1),
+                                       Beam.get_rotation_matrix(alpha1, axis=2)),
+                             translation=[0.0, -p * numpy.cos(theta_grazing1), p * numpy.sin(theta_grazing1)])
+
+        #
+        # rays lost upstream are not intercepted: the reflection is done on the good rays only and the results
+        # are copied back, so the ray order and the flags of the lost rays are preserved.
+        #
+        good = numpy.where(beam.rays[:, 9] > 0)[0]
+        if good.size == beam.rays.shape[0]:
+            good = None
+            beam_good = beam
+        else:
+            beam_good = Beam(N=good.size, column_major=beam.is_column_major())
+            numpy.take(beam.rays, good, axis=0, out=beam_good.rays, mode='clip')
 
         #
         # reflect beam in the mirror surface
         #
         soe = self.get_optical_element() #._optical_element_syned
 
-        v_in = beam.get_columns([4,5,6])
+        v_in = beam_good.get_columns([4,5,6])
         if not isinstance(soe, Mirror): # undefined
             raise Exception("Undefined mirror")
+        elif beam_good.rays.shape[0] == 0: # all the rays are lost upstream: nothing to intercept
+            mirr, normal = beam_good, None
         else:
-            mirr, normal = self.apply_local_reflection(beam)
+            mirr, normal = self.apply_local_reflection(beam_good)
 
-        #
-        # apply mirror boundaries
-        #
-        mirr.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
+            #
+            # apply mirror boundaries
+            #
+            mirr.apply_boundaries_syned(soe.get_boundary_shape(), flag_lost_value=flag_lost_value)
+
+        # the rays lost in the mirror boundaries are excluded from the rest of the calculations
+        alive = numpy.where(mirr.rays[:, 9] > 0)[0]
 
         #
         # apply mirror reflectivity
         # TODO: add phase
         #
 
-        if soe._f_reflec == 0:
+        if soe._f_reflec == 0 or alive.size == 0:
             pass
         elif soe._f_reflec == 1: # full polarization
-            v_out = beam.get_columns([4, 5, 6])
-            angle_in = numpy.arccos( v_in[0,:] * normal[0,:] +
-                                     v_in[1,:] * normal[1,:] +
-                                     v_in[2,:] * normal[2,:])
-
-            angle_out = numpy.arccos( v_out[0,:] * normal[0,:] +
-                                     v_out[1,:] * normal[1,:] +
-                                     v_out[2,:] * normal[2,:])
+            angle_in = numpy.arccos( v_in[0,alive] * normal[0,alive] +
+                                     v_in[1,alive] * normal[1,alive] +
+                                     v_in[2,alive] * normal[2,alive])
 
             grazing_angle_mrad = 1e3 * (numpy.pi / 2 - angle_in)
 
+            beam_energies = mirr.get_photon_energy_eV()[alive]
+
             if soe._f_refl == 0: # prerefl
                 prerefl_file = soe._file_refl
-                pr = PreRefl()
-                pr.read_preprocessor_file(prerefl_file)
-                print(pr.info())
+                pr = PreRefl.create_from_preprocessor_file(prerefl_file)
 
                 Rs, Rp, Ru = pr.reflectivity_fresnel(grazing_angle_mrad=grazing_angle_mrad,
-                                                     photon_energy_ev=beam.get_column(-11),
+                                                     photon_energy_ev=beam_energies,
                                                      roughness_rms_A=0.0)
 
             elif soe._f_refl == 1:  # alpha, gamma, electric susceptibilities
@@ -142,7 +158,7 @@ class S4MirrorElement(S4BeamlineElement):
                 #
                 # beam_incident_angles = 90.0 - values[:, 1]
 
-                values = numpy.loadtxt(soe._file_refl)
+                values = load_table(soe._file_refl)
 
                 mirror_grazing_angles = values[:, 0]
                 mirror_reflectivities = values[:, 1]
@@ -163,9 +179,7 @@ class S4MirrorElement(S4BeamlineElement):
 
             elif soe._f_refl == 3:  # user energy
 
-                beam_energies = beam.get_photon_energy_eV()
-
-                values = numpy.loadtxt(soe._file_refl)
+                values = load_table(soe._file_refl)
 
                 mirror_energies = values[:, 0]
                 mirror_reflectivities = values[:, 1]
@@ -178,45 +192,29 @@ class S4MirrorElement(S4BeamlineElement):
                 Rp = Rs
 
             elif soe._f_refl == 4:  # user 2D
-                values = numpy.loadtxt(soe._file_refl)
-
-                beam_energies = beam.get_photon_energy_eV()
-
-                mirror_energies       = values[:, 0]
-                mirror_grazing_angles = values[:, 1]
-                mirror_energies         = numpy.unique(mirror_energies)
-                mirror_grazing_angles   = numpy.unique(mirror_grazing_angles)
-                # if self.user_defined_angle_units  == 0: mirror_grazing_angles = numpy.degrees(1e-3*mirror_grazing_angles)
-                # if self.user_defined_energy_units == 1: mirror_energies *= 1e3 # KeV to eV
+                # the interpolators are built once per file and shared
+                interpolators = load_cached(soe._file_refl, self._create_reflectivity_2D_interpolators)
 
-                def get_interpolator_weight_2D(mirror_energies, mirror_grazing_angles, mirror_reflectivities):
-                    mirror_reflectivities = numpy.reshape(mirror_reflectivities, (mirror_energies.shape[0], mirror_grazing_angles.shape[0]))
-                    from scipy.interpolate import  RectBivariateSpline
-                    interpolator = RectBivariateSpline(mirror_energies, mirror_grazing_angles, mirror_reflectivities, kx=2, ky=2)
-
-                    interpolated_weight = numpy.zeros(beam_energies.shape[0])
-                    for energy, angle, i in zip(beam_energies, grazing_angle_mrad, range(interpolated_weight.shape[0])):
-                        interpolated_weight[i] = interpolator(energy, angle)
+                def get_interpolator_weight_2D(interpolator):
+                    interpolated_weight = interpolator.ev(beam_energies, grazing_angle_mrad)
                     interpolated_weight[numpy.where(numpy.isnan(interpolated_weight))] = 0.0
-
                     return interpolated_weight
 
-                if values.shape[1] == 3:
-                    mirror_reflectivities = values[:, 2]
-
-                    Rs = get_interpolator_weight_2D(mirror_energies, mirror_grazing_angles, mirror_reflectivities)
+                if len(interpolators) == 1:
+                    Rs = get_interpolator_weight_2D(interpolators[0])
                     Rp = Rs
-                elif values.shape[1] == 4:
-                    mirror_reflectivities_s = values[:, 2]
-                    mirror_reflectivities_p = values[:, 3]
-
-                    Rs = get_interpolator_weight_2D(mirror_energies, mirror_grazing_angles, mirror_reflectivities_s)
-                    Rp = get_interpolator_weight_2D(mirror_energies, mirror_grazing_angles, mirror_reflectivities_p)
+                elif len(interpolators) == 2:
+                    Rs = get_interpolator_weight_2D(interpolators[0])
+                    Rp = get_interpolator_weight_2D(interpolators[1])
 
             else:
                 raise Exception("Not implemented source of mirror reflectivity")
 
-            beam.apply_reflectivities(numpy.sqrt(Rs), numpy.sqrt(Rp))
+            Rs_all = numpy.ones(mirr.rays.shape[0])
+            Rp_all = numpy.ones(mirr.rays.shape[0])
+            Rs_all[alive] = Rs
+            Rp_all[alive] = Rp
+            mirr.apply_reflectivities(numpy.sqrt(Rs_all), numpy.sqrt(Rp_all))
 
 
         #
@@ -228,14 +226,40 @@ class S4MirrorElement(S4BeamlineElement):
         # from mirror reference system to image plane
         #
 
+        if good is not None:
+            beam.rays[good] = mirr.rays
+            beam.invalidate_cache()
+            mirr = beam
+        del beam_good, v_in, normal # not needed anymore: release them before allocating the output beam
+
+        # all the rays are propagated, so the lost ones are also in the image frame
         beam_out = mirr.duplicate()
-        beam_out.change_to_image_reference_system(theta_grazing1, q)
+        beam_out.change_to_image_reference_system(theta_grazing1, q, verbose=0)
 
         return beam_out, mirr
 
     def apply_local_reflection(self, beam):
         raise NotImplementedError()
 
+    @classmethod
+    def _create_reflectivity_2D_interpolators(cls, file_refl):
+        # file columns: energy in eV, grazing angle in mrad, reflectivity (s) [, reflectivity (p)]
+        from scipy.interpolate import RectBivariateSpline
+
+        values = load_table(file_refl)
+
+        mirror_energies         = numpy.unique(values[:, 0])
+        mirror_grazing_angles   = numpy.unique(values[:, 1])
+        # if self.user_defined_angle_units  == 0: mirror_grazing_angles = numpy.degrees(1e-3*mirror_grazing_angles)
+        # if self.user_defined_energy_units == 1: mirror_energies *= 1e3 # KeV to eV
+
+        interpolators = []
+        for column in range(2, values.shape[1]):
+            mirror_reflectivities = numpy.reshape(values[:, column], (mirror_energies.shape[0], mirror_grazing_angles.shape[0]))
+            interpolators.append(RectBivariateSpline(mirror_energies, mirror_grazing_angles, mirror_reflectivities, kx=2, ky=2))
+
+        return interpolators
+
     #
     # i/o utilities
     #
@@ -1,3 +1,4 @@
+import numpy
 from shadow4.syned.shape import SurfaceData
 from shadow4.beamline.optical_elements.mirrors.s4_mirror import S4MirrorElement, S4Mirror, ElementCoordinates
 from shadow4.optical_surfaces.s4_mesh import S4Mesh
@@ -27,6 +28,15 @@ class S4SurfaceDataMirror(S4Mirror, S4SurfaceDataOpticalElement):
                           f_reflec, f_refl, file_refl, refraction_index)
 
 import os
+import hashlib
+import weakref
+from shadow4.tools.cache import LRUCache, file_key
+
+# process-wide cache of the surface interpolators, shared by all surface data mirrors
+_SURFACE_SPLINE_CACHE = LRUCache(max_items=10)
+
+# digest of the xx, yy, zz arrays of each SurfaceData object (calculated once, while the arrays are the same objects)
+_SURFACE_DATA_DIGESTS = weakref.WeakKeyDictionary()
 
 class S4SurfaceDataMirrorElement(S4MirrorElement):
     def __init__(self, optical_element=None, coordinates=None):
@@ -42,13 +52,54 @@ class S4SurfaceDataMirrorElement(S4MirrorElement):
         num_mesh = S4Mesh()
 
         if surface_shape.has_surface_data():
-            num_mesh.load_surface_data(surface_shape)
+            key = ("data", self._surface_data_hash(surface_shape))
+            spline = _SURFACE_SPLINE_CACHE.get(key)
+            if spline is None:
+                num_mesh.load_surface_data(surface_shape)
+                _SURFACE_SPLINE_CACHE.put(key, num_mesh.get_spline())
+            else:
+                num_mesh.set_spline(spline)
         elif surface_shape.has_surface_data_file():
-            filename, file_extension = os.path.splitext(surface_shape._surface_data_file)
+            key = ("file",) + file_key(surface_shape._surface_data_file)
+            spline = _SURFACE_SPLINE_CACHE.get(key)
+            if spline is None:
+                filename, file_extension = os.path.splitext(surface_shape._surface_data_file)
 
-            if file_extension.lower() in [".h5", ".hdf", ".hdf5"]: num_mesh.load_h5file(surface_shape._surface_data_file)
-            else:                                                  num_mesh.load_file(surface_shape._surface_data_file) # 3 columns ASCII
+                if file_extension.lower() in [".h5", ".hdf", ".hdf5"]: num_mesh.load_h5file(surface_shape._surface_data_file)
+                else:                                                  num_mesh.load_file(surface_shape._surface_data_file) # 3 columns ASCII
+                _SURFACE_SPLINE_CACHE.put(key, num_mesh.get_spline())
+            else:
+                num_mesh.set_spline(spline)
 
         mirr, normal, _, _, _, _, _ = num_mesh.apply_specular_reflection_on_beam(beam)
 
         return mirr, normal
+
+    @classmethod
+    def _surface_data_hash(cls, surface_shape):
+        # the data arrays must not be modified in place after the first trace (assign new arrays instead)
+        arrays = (surface_shape._xx, surface_shape._yy, surface_shape._zz)
+        memo = _SURFACE_DATA_DIGESTS.get(surface_shape)
+        if memo is not None and all(a is b for a, b in zip(memo[0], arrays)):
+            return memo[1]
+
+        h = hashlib.sha1()
+        for array in arrays:
+            array = numpy.asarray(array)
+            h.update(("%s %s" % (array.dtype.str, array.shape)).encode())
+            if array.flags.c_contiguous:
+                h.update(memoryview(array).cast("B"))
+            else:
+                h.update(numpy.ascontiguousarray(array).tobytes())
+        digest = h.hexdigest()
+
+        _SURFACE_DATA_DIGESTS[surface_shape] = (arrays, digest)
+        return digest
+
+    @classmethod
+    def set_surface_cache_size(cls, max_items):
+        _SURFACE_SPLINE_CACHE.set_max_items(max_items)
+
+    @classmethod
+    def clear_surface_cache(cls):
+        _SURFACE_SPLINE_CACHE.clear()
@@ -16,8 +16,36 @@ class S4Beamline(Beamline):
     def info(self):
         return "Beamline info: to be implemented"
 
-    def run_beamline(self, **params):
-        raise NotImplementedError()
+    def run_beamline(self, beam=None, compact_threshold=None, **params):
+        """
+        Traces the beam through the beamline elements.
+
+        Parameters
+        ----------
+        beam: the input beam. If None, it is created with the light source (get_beam(**params)).
+        compact_threshold: if not None, the lost rays are removed from the beam (see Beam.compact()) after
+                           the elements where the fraction of lost rays is larger than compact_threshold.
+
+        Returns
+        -------
+        (beam, footprint) of the last element
+        """
+        if beam is None:
+            beam = self.get_light_source().get_beam(**params)
+
+        footprint = None
+        for i, element in enumerate(self.get_beamline_elements()):
+            beam_in = beam
+            beam, footprint = element.trace_beam(beam_in)
+            # the elements keep the rays (and their order): the loss record of the input beam is still valid
+            beam.set_loss_record(beam_in.get_loss_record())
+
+            if compact_threshold is not None:
+                n = beam.get_number_of_rays()
+                if n > 0 and beam.get_number_of_rays(nolost=2) > compact_threshold * n:
+                    beam.compact(element=i + 1)
+
+        return beam, footprint
 
 
 
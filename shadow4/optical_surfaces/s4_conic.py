@@ -107,14 +107,12 @@ class S4Conic(object):
 
 
     def vector_reflection(self,v1,normal):
-        tmp = v1 * normal
-        tmp2 = tmp[0,:] + tmp[1,:] + tmp[2,:]
-        tmp3 = normal.copy()
+        tmp2 = v1[0,:] * normal[0,:] + v1[1,:] * normal[1,:] + v1[2,:] * normal[2,:]
 
+        v2 = numpy.empty_like(normal)
         for jj in (0,1,2):
-            tmp3[jj,:] = tmp3[jj,:] * tmp2
+            v2[jj,:] = v1[jj,:] - 2 * (normal[jj,:] * tmp2)
 
-        v2 = v1 - 2 * tmp3
         v2mod = numpy.sqrt(v2[0,:]**2 + v2[1,:]**2 + v2[2,:]**2)
         v2 /= v2mod
 
@@ -145,20 +143,17 @@ class S4Conic(object):
         # ; TRACING...
         # ;
 
-        x1 =   newbeam.get_columns([1,2,3]) # numpy.array(a3.getshcol([1,2,3]))
-        v1 =   newbeam.get_columns([4,5,6]) # numpy.array(a3.getshcol([4,5,6]))
+        # read only views (no copies): they are only read before the columns are updated
+        x1 =   newbeam.get_columns([1,2,3], copy=False) # numpy.array(a3.getshcol([1,2,3]))
+        v1 =   newbeam.get_columns([4,5,6], copy=False) # numpy.array(a3.getshcol([4,5,6]))
         flag = newbeam.get_column(10)        # numpy.array(a3.getshonecol(10))
         optical_path = newbeam.get_column(13)
 
-        t1,t2 = self.calculate_intercept(x1,v1)
-        t, iflag = self.choose_solution(t1,t2,reference_distance=-newbeam.get_column(2).mean())
-
-        # for i in range(t.size):
-        #     print(">>>> solutions: ",t1[i],t2[i],t[i])
+        t, iflag = self.calculate_intercept_and_choose_solution(x1, v1,
+                                                reference_distance=-newbeam.get_column(2).mean())
 
         x2 = x1 + v1 * t
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
 
         # ;
@@ -188,7 +183,8 @@ class S4Conic(object):
 
         return newbeam, normal
 
-    def calculate_intercept(self,XIN,VIN,keep=0):
+    def calculate_intercept(self,XIN,VIN,keep=0,return_flags=False):
+        # returns TPAR1, TPAR2 (and also IFLAG, negative if there is no intersection, if return_flags=True)
 
         # # FUNCTION conicintercept,ccc,xIn1,vIn1,iflag,keep=keep
         # #
@@ -314,54 +310,51 @@ class S4Conic(object):
         # ;C
 
 
-        TPAR = numpy.zeros_like(AA)
         TPAR1 = numpy.zeros_like(AA)
         TPAR2 = numpy.zeros_like(AA)
         IFLAG = numpy.ones_like(AA)
 
-        # shape_x =  x.shape
-
-        # TODO: remove loop!
-        for i in range(AA.size):
-            if numpy.abs(AA[i])  < 1e-15:
-                TPAR1[i] = - CC[i] / BB[i]
-                TPAR2[i] = TPAR1[i]
-            else:
-
-                DENOM = 0.5 / AA[i]
-                DETER = BB[i] ** 2 - CC[i] * AA[i] * 4
-
-                if DETER < 0.0:
-
-                    TPAR[i] = 0.0
-                    IFLAG[i] = -1
-                else:
-                    TPAR1[i] = -(BB[i] + numpy.sqrt(DETER)) * DENOM
-                    TPAR2[i] = -(BB[i] - numpy.sqrt(DETER)) * DENOM
-
-        if TPAR2.size == 1:
-            TPAR2 = numpy.asscalar(TPAR2)
-
-        return TPAR1.real,TPAR2.real
+        # degenerated case (linear equation)
+        linear = numpy.abs(AA) < 1e-15
+        quadratic = ~linear
 
+        # no intercept (e.g. ray parallel to a plane)
+        IFLAG[linear & (BB == 0)] = -1
 
+        linear_solution = linear & (BB != 0)
+        TPAR1[linear_solution] = - CC[linear_solution] / BB[linear_solution]
+        TPAR2[linear_solution] = TPAR1[linear_solution]
 
+        DETER = BB ** 2 - CC * AA * 4
+        complex_solution = quadratic & (DETER < 0.0)
+        IFLAG[complex_solution] = -1
 
-    def choose_solution(self,TPAR1,TPAR2,reference_distance=10.0):
-        #todo remove this nasty thing
-        TPAR = numpy.zeros_like(TPAR1)
-        I_FLAG = numpy.ones_like(TPAR1)
+        real_solution = quadratic & (DETER >= 0.0)
+        DENOM = 0.5 / AA[real_solution]
+        SQRT_DETER = numpy.sqrt(DETER[real_solution])
+        TPAR1[real_solution] = -(BB[real_solution] + SQRT_DETER) * DENOM
+        TPAR2[real_solution] = -(BB[real_solution] - SQRT_DETER) * DENOM
 
+        if return_flags:
+            return TPAR1.real, TPAR2.real, IFLAG
+        return TPAR1.real, TPAR2.real
 
+    def choose_solution(self,TPAR1,TPAR2,reference_distance=10.0,IFLAG=None):
+        # keeps, for each ray, the solution closest to reference_distance
+        TPAR = numpy.where(numpy.abs(TPAR1 - reference_distance) <= numpy.abs(TPAR2 - reference_distance),
+                           TPAR1, TPAR2)
 
-        for i in range(TPAR1.size):
-            if ( numpy.abs(TPAR1[i]-reference_distance) <= numpy.abs(TPAR2[i]-reference_distance)):
-               TPAR[i] = TPAR1[i]
-            else:
-               TPAR[i] = TPAR2[i]
+        if IFLAG is None:
+            I_FLAG = numpy.ones_like(TPAR1)
+        else:
+            I_FLAG = IFLAG.copy()
 
         return TPAR,I_FLAG
 
+    def calculate_intercept_and_choose_solution(self,XIN,VIN,reference_distance=10.0):
+        TPAR1, TPAR2, IFLAG = self.calculate_intercept(XIN, VIN, return_flags=True)
+        return self.choose_solution(TPAR1, TPAR2, reference_distance=reference_distance, IFLAG=IFLAG)
+
 
     def z_vs_xy(self,x,y):
 
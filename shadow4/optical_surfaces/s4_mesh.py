@@ -7,6 +7,8 @@ from scipy.optimize import fsolve
 from scipy import interpolate
 from srxraylib.plot.gol import plot,plot_image, plot_surface, plot_scatter
 import sys
+import os
+import hashlib
 
 import numpy
 
@@ -65,6 +67,7 @@ class S4Mesh(object):
     def __init__(self, surface=None):
         self.__x0 = [0.0,0.0,0.0]
         self.__v0 = [0.0,0.0,0.0]
+        self.__spline = None
         self.surface = surface
 
     def line(self,t):
@@ -92,112 +95,122 @@ class S4Mesh(object):
         self.__v0 = v0
 
     def set_surface(self,surface):
+        self.__spline = None
         self.surface = surface
 
+    def set_spline(self,spline):
+        # spline is a regular-grid spline (e.g. scipy.interpolate.RectBivariateSpline) with z = spline.ev(x,y)
+        self.__spline = spline
+        self.surface = spline.ev
+
+    def get_spline(self):
+        return self.__spline
+
     def load_h5file(self,filename,kind='cubic'):
         x,y,z = self.read_surface_error_h5file(filename)
-        self.surface = interpolate.interp2d(x,y,z.T, kind=kind)
+        self.load_surface_data_arrays(x,y,z,kind=kind)
 
     def load_surface_data(self, surface_data_object, kind='cubic'):
-        self.surface = interpolate.interp2d(surface_data_object._xx, surface_data_object._yy, surface_data_object._zz, kind=kind)
+        self.load_surface_data_arrays(surface_data_object._xx, surface_data_object._yy, surface_data_object._zz.T, kind=kind)
 
     def load_surface_data_arrays(self,x,y,Z,kind='cubic'):
-        self.surface = interpolate.interp2d(x,y,Z.T, kind=kind)
+        # Z[x_index, y_index]
+        degree = {'linear':1, 'cubic':3, 'quintic':5}[kind]
+        self.set_spline(interpolate.RectBivariateSpline(x, y, Z, kx=degree, ky=degree))
 
-    def load_file(self,filename,kind='cubic'):
-        x,y,z = self.read_surface_error_file(filename)
-        self.surface = interpolate.interp2d(x,y,z.T, kind=kind)
+    def load_file(self,filename,kind='cubic',cache_directory=None):
+        x,y,z = self.read_surface_error_file(filename, cache_directory=cache_directory)
+        self.load_surface_data_arrays(x,y,z,kind=kind)
 
     @classmethod
-    def read_surface_error_h5file(cls, filename):
+    def read_surface_error_h5file(cls, filename, x_range=None, y_range=None):
+        """
+        Reads a surface error file in hdf5 format.
+
+        :param filename: the file name
+        :param x_range: if not None, [x_min, x_max] to read only a window of the map in X
+        :param y_range: if not None, [y_min, y_max] to read only a window of the map in Y
+        :return: x, y, Z[x_index, y_index]
+        """
         import h5py
         f = h5py.File(filename, 'r')
         x = f["/surface_file/X"][:]
         y = f["/surface_file/Y"][:]
-        Z = f["/surface_file/Z"][:]
-        f.close()
-        return x, y, Z.T.copy()
-
-
-    #copied from shadowOui util/shadow_util
-    @classmethod
-    def read_surface_error_file(cls, filename):
-
-        file = open(filename, "r")
-
-        rows = file.readlines()
-
-        dimensions = rows[0].split()
-        n_x = int(dimensions[0])
-        n_y = int(dimensions[1])
-
-        if n_x > 500:
-            raise Exception("Malformed file: maximum allowed point in X direction is 500")
-
-        x_coords = numpy.zeros(0)
-        y_coords = numpy.zeros(0)
-        z_values = numpy.zeros((n_x, n_y))
-
 
-        index = 1
-        dim_y_row = len(rows[index].split())
-        is_ycoord = True
-        first_x_row_index = 0
+        x_slice = cls._window_slice(x, x_range)
+        y_slice = cls._window_slice(y, y_range)
 
-        while(is_ycoord):
-            y_values = rows[index].split()
-
-            if len(y_values) == dim_y_row:
-                for y_value in y_values:
-                    y_coords = numpy.append(y_coords, float(y_value))
-            else:
-                first_x_row_index = index
-                is_ycoord = False
-
-            index +=1
-
-        first_x_row = rows[first_x_row_index].split()
-
-        if len(first_x_row) == 2:
-            x_index = 0
-            z_index = 0
-
-            for index in range(first_x_row_index, len(rows)):
-                if z_index == 0:
-                    values = rows[index].split()
-                    x_coords = numpy.append(x_coords, float(values[0]))
-                    z_value = float(values[1])
-                else:
-                    z_value = float(rows[index])
-
-                z_values[x_index, z_index] = z_value
-                z_index += 1
-
-                if z_index == n_y:
-                    x_index += 1
-                    z_index = 0
-        else:
-            x_rows = []
-
-            for index in range(2, len(rows)):
+        # only the requested hyperslab is read from disk. Z is stored as Z[y_index, x_index]
+        Z = f["/surface_file/Z"][y_slice, x_slice]
+        f.close()
+        return x[x_slice], y[y_slice], Z.T.copy()
 
-                x_row = rows[index].split("\t")
+    @classmethod
+    def _window_slice(cls, coordinates, coordinates_range):
+        if coordinates_range is None:
+            return slice(0, coordinates.size)
+        i0 = numpy.searchsorted(coordinates, coordinates_range[0], side='left')
+        i1 = numpy.searchsorted(coordinates, coordinates_range[1], side='right')
+        return slice(i0, i1)
 
-                if len(x_row) != 1 + n_y:
-                    x_row = rows[index].split()
+    @classmethod
+    def read_surface_error_file(cls, filename, cache_directory=None):
+        """
+        Reads a surface error file in SHADOW format:
+            n_x n_y
+            y[0] ... y[n_y-1]
+            x[0] z[0,0] ... z[0,n_y-1]
+            ...
+        (the values can be split in any number of lines).
+
+        :param filename: the file name
+        :param cache_directory: if not None, a binary copy of the data is written in this directory
+                                after parsing, and used in the next calls while the original file
+                                is not modified.
+        :return: x, y, Z[x_index, y_index]
+        """
+
+        if cache_directory is not None:
+            cache_file = os.path.join(cache_directory, "surface_error_%s.npz" %
+                                      hashlib.sha1(os.path.abspath(filename).encode()).hexdigest())
+            stat = os.stat(filename)
+            try:
+                with open(cache_file, "rb") as file, numpy.load(file) as cache:
+                    if cache["mtime"] == stat.st_mtime and cache["size"] == stat.st_size:
+                        return cache["x"], cache["y"], cache["z"]
+            except Exception: # missing, incomplete or unreadable cache file: parse the original file
+                pass
 
-                if len(x_row) != 1 + n_y:
-                    raise Exception("Malformed file: check format")
+        with open(filename, "r") as file:
+            try:
+                values = numpy.fromstring(file.read(), sep=" ")
+            except ValueError:
+                raise Exception("Malformed file: check format")
 
-                x_rows.append(x_row)
+        n_x = int(values[0])
+        n_y = int(values[1])
 
-            for x_index in range(0, len(x_rows)):
-                x_coords = numpy.append(x_coords, float(x_rows[x_index][0]))
+        if values.size != 2 + n_y + n_x * (n_y + 1):
+            raise Exception("Malformed file: check format")
 
-                for z_index in range(0, len(x_rows[x_index]) - 1):
-                    z_value = float(x_rows[x_index][z_index + 1])
+        y_coords = values[2:2 + n_y].copy()
+        x_rows = values[2 + n_y:].reshape((n_x, n_y + 1))
+        x_coords = x_rows[:, 0].copy()
+        z_values = x_rows[:, 1:].copy()
 
-                    z_values[x_index, z_index] = z_value
+        if cache_directory is not None:
+            # write to a temporary file and rename it, so other processes never read an incomplete file
+            tmp_file = "%s.%d.tmp.npz" % (cache_file, os.getpid())
+            try:
+                os.makedirs(cache_directory, exist_ok=True)
+                numpy.savez(tmp_file, x=x_coords, y=y_coords, z=z_values,
+                            mtime=stat.st_mtime, size=stat.st_size)
+                os.replace(tmp_file, cache_file)
+            except OSError: # e.g., read-only directory
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
 
         return x_coords, y_coords, z_values
 
@@ -208,21 +221,21 @@ class S4Mesh(object):
 
         normal = numpy.zeros_like(x2)
 
-        eps = 100 * sys.float_info.epsilon
-
         X_0 = x2[0,:]
         Y_0 = x2[1,:]
-        Z_0 = x2[2,:]
-
-        N_0 = numpy.zeros_like(X_0)
-        N_1 = numpy.zeros_like(X_0)
-        N_2 = numpy.ones_like(X_0)
-        for i in range(X_0.size):
-            z00 = self.surface(X_0[i],Y_0[i])
-            N_0[i] = -1.0 * (self.surface(X_0[i]+eps,Y_0[i]) - z00) / eps
-            N_1[i] = -1.0 * (self.surface(X_0[i],Y_0[i]+eps) - z00) / eps
 
+        if self.__spline is not None:
+            # analytic partial derivatives of the spline
+            N_0 = -1.0 * self.__spline.ev(X_0, Y_0, dx=1, dy=0)
+            N_1 = -1.0 * self.__spline.ev(X_0, Y_0, dx=0, dy=1)
+        else:
+            # generic surface function: centered finite differences
+            eps = numpy.sqrt(sys.float_info.epsilon) * numpy.maximum(1.0, numpy.abs(X_0))
+            N_0 = -1.0 * (self.surface(X_0 + eps, Y_0) - self.surface(X_0 - eps, Y_0)) / (2 * eps)
+            eps = numpy.sqrt(sys.float_info.epsilon) * numpy.maximum(1.0, numpy.abs(Y_0))
+            N_1 = -1.0 * (self.surface(X_0, Y_0 + eps) - self.surface(X_0, Y_0 - eps)) / (2 * eps)
 
+        N_2 = numpy.ones_like(X_0)
 
         n2 = numpy.sqrt(N_0**2 + N_1**2 + N_2**2)
         #
@@ -232,23 +245,62 @@ class S4Mesh(object):
 
         return normal
 
-    def calculate_intercept(self,XIN,VIN,keep=0):
+    def calculate_intercept(self,XIN,VIN,keep=0,max_iterations=100,tolerance=1e-12):
+        #
+        # solves surface(x0 + vx t, y0 + vy t) = z0 + vz t for all rays at once with the secant method.
+        # Rays not converged after max_iterations (or with a degenerated iteration) are flagged with -1.
+        #
 
         npoints = XIN.shape[1]
-        answer = numpy.zeros(npoints)
-        i_flag = numpy.ones(npoints)
 
+        X0, Y0, Z0 = XIN[0,:], XIN[1,:], XIN[2,:]
+        VX, VY, VZ = VIN[0,:], VIN[1,:], VIN[2,:]
+
+        def residual(t, index):
+            return self.surface(X0[index] + VX[index] * t, Y0[index] + VY[index] * t) - \
+                   (Z0[index] + VZ[index] * t)
+
+        everything = numpy.arange(npoints)
+
+        # starting points: t=0 and the intercept with the z=0 plane
+        t_a = numpy.zeros(npoints)
+        t_b = numpy.ones(npoints)
+        non_parallel = VZ != 0
+        t_b[non_parallel] = -Z0[non_parallel] / VZ[non_parallel]
+        t_b[t_b == t_a] = 1.0
+
+        f_a = residual(t_a, everything)
+        f_b = residual(t_b, everything)
+
+        converged = (f_b == 0)
+        active = ~converged
+
+        for iteration in range(max_iterations):
+            index = numpy.nonzero(active)[0]
+            if index.size == 0:
+                break
+
+            df = f_b[index] - f_a[index]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                t_new = t_b[index] - f_b[index] * (t_b[index] - t_a[index]) / df
+
+            failed = ~numpy.isfinite(t_new)
+            active[index[failed]] = False
+            index = index[~failed]
+            t_new = t_new[~failed]
+
+            t_a[index] = t_b[index]
+            f_a[index] = f_b[index]
+            t_b[index] = t_new
+            f_b[index] = residual(t_new, index)
+
+            done = (numpy.abs(t_b[index] - t_a[index]) <= tolerance * (1.0 + numpy.abs(t_new))) | (f_b[index] == 0)
+            converged[index[done]] = True
+            active[index[done]] = False
+
+        answer = numpy.where(converged, t_b, 0.0)
+        i_flag = numpy.where(converged, 1.0, -1.0)
 
-        print(">>>>> main loop to find solutions (slow...)")
-        for i in range(npoints):
-            self.__x0 = XIN[:,i]
-            self.__v0 = VIN[:,i]
-            try:
-                t_solution = self.solve(0.0)
-                answer[i] = t_solution
-            except:
-                i_flag[i] = -1
-        print(">>>>> done main loop to find solutions (Thanks for waiting!)")
         return answer,i_flag
 
     def apply_specular_reflection_on_beam(self,newbeam):
@@ -268,8 +320,7 @@ class S4Mesh(object):
         x2[1,:] = x1[1,:] + v1[1,:] * t
         x2[2,:] = x1[2,:] + v1[2,:] * t
 
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
         # # ;
         # # ; Calculates the normal at each intercept
@@ -287,27 +338,25 @@ class S4Mesh(object):
         # # ; writes the mirr.XX file
         # # ;
 
-        newbeam.rays[:,1-1] = x2[0,:]
-        newbeam.rays[:,2-1] = x2[1,:]
-        newbeam.rays[:,3-1] = x2[2,:]
-        newbeam.rays[:,4-1] = v2[0,:]
-        newbeam.rays[:,5-1] = v2[1,:]
-        newbeam.rays[:,6-1] = v2[2,:]
-        newbeam.rays[:,10-1] = flag
-        newbeam.rays[:,13-1] = optical_path + t
+        newbeam.set_column(1, x2[0,:])
+        newbeam.set_column(2, x2[1,:])
+        newbeam.set_column(3, x2[2,:])
+        newbeam.set_column(4, v2[0,:])
+        newbeam.set_column(5, v2[1,:])
+        newbeam.set_column(6, v2[2,:])
+        newbeam.set_column(10, flag)
+        newbeam.set_column(13, optical_path + t)
         #
         return newbeam,normal,t,x1,v1,x2,v2
 
     # todo: move to superclass or Vector class
     def vector_reflection(self,v1,normal):
-        tmp = v1 * normal
-        tmp2 = tmp[0,:] + tmp[1,:] + tmp[2,:]
-        tmp3 = normal.copy()
+        tmp2 = v1[0,:] * normal[0,:] + v1[1,:] * normal[1,:] + v1[2,:] * normal[2,:]
 
+        v2 = numpy.empty_like(normal)
         for jj in (0,1,2):
-            tmp3[jj,:] = tmp3[jj,:] * tmp2
+            v2[jj,:] = v1[jj,:] - 2 * (normal[jj,:] * tmp2)
 
-        v2 = v1 - 2 * tmp3
         v2mod = numpy.sqrt(v2[0,:]**2 + v2[1,:]**2 + v2[2,:]**2)
         v2 /= v2mod
 
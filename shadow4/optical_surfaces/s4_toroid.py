@@ -112,14 +112,12 @@ class S4Toroid(object):
 
 
     def vector_reflection(self,v1,normal):
-        tmp = v1 * normal
-        tmp2 = tmp[0,:] + tmp[1,:] + tmp[2,:]
-        tmp3 = normal.copy()
+        tmp2 = v1[0,:] * normal[0,:] + v1[1,:] * normal[1,:] + v1[2,:] * normal[2,:]
 
+        v2 = numpy.empty_like(normal)
         for jj in (0,1,2):
-            tmp3[jj,:] = tmp3[jj,:] * tmp2
+            v2[jj,:] = v1[jj,:] - 2 * (normal[jj,:] * tmp2)
 
-        v2 = v1 - 2 * tmp3
         v2mod = numpy.sqrt(v2[0,:]**2 + v2[1,:]**2 + v2[2,:]**2)
         v2 /= v2mod
 
@@ -273,59 +271,52 @@ class S4Toroid(object):
 
         i_res = numpy.ones_like(AA)
         answer = numpy.ones_like(AA)
-        for k in range(AA.size):
-            # print("coeff: ",i,1.0,AA[i],BB[i],CC[i],DD[i])
-            coeff = numpy.array([1.0,AA[k],BB[k],CC[k],DD[k]])
-            # print("coeff: ",i,coeff.shape,coeff)
-            h_output = numpy.roots(coeff)
-            # print(i,h_output)
 
+        #
+        # solve all the quartic equations at once: the roots are the eigenvalues of the
+        # stacked companion matrices (the same algorithm used by numpy.roots).
+        #
+        companion = numpy.zeros((AA.size, 4, 4))
+        companion[:, 0, 0] = -AA
+        companion[:, 0, 1] = -BB
+        companion[:, 0, 2] = -CC
+        companion[:, 0, 3] = -DD
+        companion[:, 1, 0] = 1.0
+        companion[:, 2, 1] = 1.0
+        companion[:, 3, 2] = 1.0
+        h_output = numpy.linalg.eigvals(companion)
+
+        #! C
+        #! C Sort the real intercept in ascending order (complex ones are set to nan and go at the end).
+        #! C
+
+        is_real = (h_output.imag == 0)
+        n_real = is_real.sum(axis=1)
+        Answers = numpy.sort(numpy.where(is_real, h_output.real, numpy.nan), axis=1)
+
+        # all the solutions are complex
+        i_res[n_real == 0] = -1
+        answer[n_real == 0] = 0.0
 
+        # ! C
+        # ! C Pick the output according to F_TORUS.
+        # ! C
 
-
-
-
-            # test1 = h_output.imag
-            # test2 = numpy.zeros_like(test1)
-            # # print(test1)
-
-            if h_output.imag.prod() != 0:
-                print("all the solutions are complex")
-                i_res[k] = -1
-                answer[k] = 0.0
-            else:
-                Answers = []
-
-                for i in range(4):
-                    if h_output[i].imag == 0:
-                        Answers.append(h_output[i].real)
-
-                #! C
-                #! C Sort the real intercept in ascending order.
-                #! C
-
-                Answers = numpy.sort(numpy.array(Answers))
-
-                # ! C
-                # ! C Pick the output according to F_TORUS.
-                # ! C
-
-                # TODO check correctness of  indices not shifted
-                if self.f_torus == 0:
-                    answer[k] = Answers[-1]
-                elif self.f_torus == 1:
-                    if len(Answers) > 1:
-                        answer[k] = Answers[-1]
-                    else:
-                        i_res[k] = -1
-                elif self.f_torus == 2:
-                    if len(Answers) > 1:
-                        answer[k] = Answers[1]
-                    else:
-                        i_res[k] = -1
-                elif self.f_torus == 3:
-                    answer[k] = Answers[0]
-
+        index = numpy.arange(AA.size)
+        if self.f_torus == 0:
+            good = n_real > 0
+            answer[good] = Answers[index[good], n_real[good] - 1]
+        elif self.f_torus == 1:
+            good = n_real > 1
+            i_res[n_real == 1] = -1
+            answer[good] = Answers[index[good], n_real[good] - 1]
+        elif self.f_torus == 2:
+            good = n_real > 1
+            i_res[n_real == 1] = -1
+            answer[good] = Answers[good, 1]
+        elif self.f_torus == 3:
+            good = n_real > 0
+            answer[good] = Answers[good, 0]
 
         return answer,i_res
 
@@ -396,8 +387,7 @@ class S4Toroid(object):
         #     print(">>>>",x1[0:3,i],t[i],iflag[i])
 
         x2 = x1 + v1 * t
-        for i in range(flag.size):
-            if iflag[i] < 0: flag[i] = -100
+        flag[iflag < 0] = -100
 
 
         # ;
@@ -9,6 +9,8 @@ TODO: vectorization
 import numpy
 import scipy.constants as codata
 
+from shadow4.tools.cache import load_cached
+
 tocm = codata.h * codata.c / codata.e * 1e2 # 12398.419739640718e-8
 
 class PreRefl(object):
@@ -45,6 +47,24 @@ class PreRefl(object):
 
         self.prerefl_dict = {"QMIN":QMIN,"QMAX":QMAX,"QSTEP":QSTEP,"DEPTH0":DEPTH0,"NREFL":NREFL,"ZF1":ZF1,"ZF2":ZF2}
 
+    @classmethod
+    def create_from_preprocessor_file(cls, filename, use_cache=True):
+        """
+        Returns a PreRefl instance with the contents of a prerefl file. If use_cache=True, the instance
+        is shared with other callers and the file is only read again if it was modified.
+        """
+        if use_cache:
+            return load_cached(filename, cls._create_from_preprocessor_file)
+        else:
+            return cls._create_from_preprocessor_file(filename)
+
+    @classmethod
+    def _create_from_preprocessor_file(cls, filename):
+        pr = PreRefl()
+        pr.read_preprocessor_file(filename)
+        print(pr.info())
+        return pr
+
     def preprocessor_info(self,verbose=False):
 
         print("\n========================================")
@@ -220,9 +220,7 @@ class S4BendingMagnetLightSource(LightSource, S4LightSource):
                 plot_image(fm,angle_array_mrad,photon_energy_array,aspect='auto',show=0,title="flux",xtitle="Psi / mrad",ytitle="Energy / eV")
                 plot_image(fm_s/fm,angle_array_mrad,photon_energy_array,aspect='auto',title="polarization",xtitle="Psi / mrad",ytitle="Energy / eV")
 
-            fm1 = numpy.zeros_like(fm)
-            for i in range(fm.shape[0]):
-                fm1[i,:] = fm[i,:] / (photon_energy_array*0.001)  # in photons/ev
+            fm1 = fm / (photon_energy_array*0.001)  # in photons/ev
 
             # plot_image(fm,angle_array_mrad,photon_energy_array,aspect='auto',show=0)
             # plot_image(fm_s/fm,angle_array_mrad,photon_energy_array,aspect='auto',title="polarization")
@@ -232,210 +230,161 @@ class S4BendingMagnetLightSource(LightSource, S4LightSource):
             sampled_angle,sampled_photon_energy = sampler2.get_n_sampled_points(NRAYS)
 
 
-            Angle_array_mrad = numpy.outer(angle_array_mrad,numpy.ones_like(photon_energy_array))
-            Photon_energy_array = numpy.outer(numpy.ones_like(angle_array_mrad),photon_energy_array)
-            Pi = numpy.array([Angle_array_mrad.flatten()*1e-3, Photon_energy_array.flatten()]).transpose()
+            # the polarization is known on the regular (angle, energy) grid
+            pol_deg_interpolator = interpolate.RegularGridInterpolator(
+                (angle_array_mrad*1e-3, photon_energy_array), fm_s/fm, bounds_error=False, fill_value=None)
 
             P = numpy.array([sampled_angle, sampled_photon_energy]).transpose()
-            sampled_polarization = interpolate.griddata(Pi, (fm_s/fm).flatten(), P, method = "cubic")
-
-        for itik in range(NRAYS):
-            # ! Synchrontron depth
-            ANGLE  =  numpy.random.random() * (HDIV1 + HDIV2) - HDIV2
-            EPSI_PATH =  numpy.abs(r_aladdin) * ANGLE
-
-            if self.get_magnetic_structure()._FLAG_EMITTANCE:
-                sigma_x, sigma_xp, sigma_z, sigma_zp = self.get_electron_beam().get_sigmas_all()
-
-                # ! calculation of the electrom beam moments at the current position
-                # ! (sX,sZ) = (epsi_wx,epsi_ez):
-                # ! <x2> = sX^2 + sigmaX^2
-                # ! <x x'> = sX sigmaXp^2
-                # ! <x'2> = sigmaXp^2                 (same for Z)
-
-                epsi_wX = EPSI_DX + EPSI_PATH # sigma_x * sigma_xp
-
-
-                # ! C
-                # ! C Compute the actual distance (EPSI_W*) from the orbital focus
-                # ! C
-                # EPSI_WX = EPSI_DX + EPSI_PATH
-                # EPSI_WZ = EPSI_DZ + EPSI_PATH
-
-                rSigmaX = numpy.sqrt( (epsi_wX**2) * (sigma_xp**2) + sigma_x**2 )
-                rSigmaXp = sigma_xp
-                if rSigmaX * rSigmaXp != 0.0:
-                    rhoX = epsi_wX * sigma_xp**2 / (rSigmaX * rSigmaXp)
-                else:
-                    rhoX = 0.0
-                mean = [0, 0]
-                cov = [[rSigmaX**2, rhoX*rSigmaX*rSigmaXp], [rhoX*rSigmaX*rSigmaXp, rSigmaXp**2]]  # diagonal covariance
-                sampled_x, sampled_xp = numpy.random.multivariate_normal(mean, cov, 1).T
-                # plot_scatter(sampled_x,sampled_xp,title="X")
-                XXX = sampled_x
-                E_BEAM1 = sampled_xp
-
-
-                epsi_wZ = EPSI_DZ + EPSI_PATH # sigma_z * sigma_zp
-                rSigmaZ = numpy.sqrt( (epsi_wZ**2) * (sigma_zp**2) + sigma_z**2 )
-                rSigmaZp = sigma_zp
-                if rSigmaZ * rSigmaZp != 0.0:
-                    rhoZ = epsi_wZ * sigma_zp**2 / (rSigmaZ * rSigmaZp)
-                else:
-                    rhoZ = 0.0
-                mean = [0, 0]
-                cov = [[rSigmaZ**2, rhoZ*rSigmaZ*rSigmaZp], [rhoZ*rSigmaZ*rSigmaZp, rSigmaZp**2]]  # diagonal covariance
-                sampled_z, sampled_zp = numpy.random.multivariate_normal(mean, cov, 1).T
-                # plot_scatter(sampled_z,sampled_zp,title="Z")
-                ZZZ = sampled_z
-                E_BEAM3 = sampled_zp
-
-                # print(">>>>>>>>>",sampled_x,sampled_z)
-            else:
-                sigma_x, sigma_xp, sigma_z, sigma_zp = (0.0, 0.0, 0.0, 0.0)
-                rhoX = 0.0
-                XXX = 0.0
-                E_BEAM1 = 0.0
-                ZZZ = 0.0
-                E_BEAM3 = 0.0
+            sampled_polarization = pol_deg_interpolator(P)
 
+        # ! Synchrontron depth
+        ANGLE  =  numpy.random.random(NRAYS) * (HDIV1 + HDIV2) - HDIV2
+        EPSI_PATH =  numpy.abs(r_aladdin) * ANGLE
+
+        if self.get_magnetic_structure()._FLAG_EMITTANCE:
+            sigma_x, sigma_xp, sigma_z, sigma_zp = self.get_electron_beam().get_sigmas_all()
+
+            # ! calculation of the electrom beam moments at the current position
+            # ! (sX,sZ) = (epsi_wx,epsi_ez):
+            # ! <x2> = sX^2 + sigmaX^2
+            # ! <x x'> = sX sigmaXp^2
+            # ! <x'2> = sigmaXp^2                 (same for Z)
 
             # ! C
-            # ! C Synchrotron depth distribution
+            # ! C Compute the actual distance (EPSI_W*) from the orbital focus
             # ! C
-            # 440	CONTINUE
-            # ! CC	R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
-            # IF (R_ALADDIN.LT.0) THEN
-            # YYY = (ABS(R_ALADDIN) + XXX) * SIN(ANGLE)
-            # ELSE
-            # YYY = ( R_ALADDIN - XXX) * SIN(ANGLE)
-            # END IF
-            # XXX  =   COS(ANGLE) * XXX + R_ALADDIN * (1.0D0 - COS(ANGLE))
+            # EPSI_WX = EPSI_DX + EPSI_PATH
+            # EPSI_WZ = EPSI_DZ + EPSI_PATH
 
+            epsi_wX = EPSI_DX + EPSI_PATH # sigma_x * sigma_xp
+            XXX, E_BEAM1 = self.__sample_electron_phase_space(epsi_wX, sigma_x, sigma_xp)
 
-            # Synchrotron depth distribution
-            # R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
-            if r_aladdin < 0:
-                YYY = numpy.abs(r_aladdin + XXX) * numpy.sin(ANGLE)
-            else:
-                YYY = numpy.abs(r_aladdin - XXX) * numpy.sin(ANGLE)
+            epsi_wZ = EPSI_DZ + EPSI_PATH # sigma_z * sigma_zp
+            ZZZ, E_BEAM3 = self.__sample_electron_phase_space(epsi_wZ, sigma_z, sigma_zp)
+        else:
+            XXX = numpy.zeros(NRAYS)
+            E_BEAM1 = numpy.zeros(NRAYS)
+            ZZZ = numpy.zeros(NRAYS)
+            E_BEAM3 = numpy.zeros(NRAYS)
 
-            XXX = numpy.cos(ANGLE) * XXX + r_aladdin * (1.0 - numpy.cos(ANGLE))
 
-            rays[itik,0] = XXX
-            rays[itik,1] = YYY
-            rays[itik,2] = ZZZ
+        # ! C
+        # ! C Synchrotron depth distribution
+        # ! C
+        # 440	CONTINUE
+        # ! CC	R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
+        # IF (R_ALADDIN.LT.0) THEN
+        # YYY = (ABS(R_ALADDIN) + XXX) * SIN(ANGLE)
+        # ELSE
+        # YYY = ( R_ALADDIN - XXX) * SIN(ANGLE)
+        # END IF
+        # XXX  =   COS(ANGLE) * XXX + R_ALADDIN * (1.0D0 - COS(ANGLE))
+
+
+        # Synchrotron depth distribution
+        # R_ALADDIN NEGATIVE FOR COUNTER-CLOCKWISE SOURCE
+        if r_aladdin < 0:
+            YYY = numpy.abs(r_aladdin + XXX) * numpy.sin(ANGLE)
+        else:
+            YYY = numpy.abs(r_aladdin - XXX) * numpy.sin(ANGLE)
 
-            # ! C
-            # ! C Synchrotron source
-            # ! C Note. The angle of emission IN PLANE is the same as the one used
-            # ! C before. This will give rise to a source curved along the orbit.
-            # ! C The elevation angle is instead characteristic of the SR distribution.
-            # ! C The electron beam emittance is included at this stage. Note that if
-            # ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
-            # ! C
-            # ANGLEX =   ANGLE + E_BEAM(1)
-            # DIREC(1)  =   TAN(ANGLEX)
-            # IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
-            # DIREC(2)  =   1.0D0
-            # ARG_ANG  =   GRID(6,ITIK)
-
-            ANGLEX = ANGLE + E_BEAM1
-            DIREC1 = numpy.tan(ANGLEX)
-            if r_aladdin < 0:
-                DIREC1 *= -1.0
-            DIREC2 = 1.0
-            ARG_ANG = numpy.random.random()
+        XXX = numpy.cos(ANGLE) * XXX + r_aladdin * (1.0 - numpy.cos(ANGLE))
 
-            # ! C
-            # ! C In the case of SR, we take into account the fact that the electron
-            # ! C trajectory is not orthogonal to the field. This will give a correction
-            # ! C to the photon energy.  We can write it as a correction to the
-            # ! C magnetic field strength; this will linearly shift the critical energy
-            # ! C and, with it, the energy of the emitted photon.
-            # ! C
-            # E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
-            # E_TEMP(2) =   1.0D0
-            # E_TEMP(1) =   TAN(E_BEAM(1))
-            # CALL NORM (E_TEMP,E_TEMP)
-            # CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
-            # 4400 CONTINUE
-            E_TEMP3 = numpy.tan(E_BEAM3) / numpy.cos(E_BEAM1)
-            E_TEMP2 = 1.0
-            E_TEMP1 = numpy.tan(E_BEAM1)
-            E_TEMP_MOD = numpy.sqrt(E_TEMP1**2 + E_TEMP2**2 + E_TEMP3**2)
-            E_TEMP3 /= E_TEMP_MOD
-            E_TEMP2 /= E_TEMP_MOD
-            E_TEMP1 /= E_TEMP_MOD
-
-            # IF (FDISTR.EQ.6) THEN ! exect synchtotron
-            #     CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
-            #     Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
-            #     POL_DEG =   ARG_ANG
-            # ELSE IF (FDISTR.EQ.4) THEN  ! synchrotron
-            #     print*,"R_MAGNET, DIREC",R_MAGNET,DIREC
-            #     ARG_ENER =   WRAN (ISTAR1)
-            #     RAD_MIN =   ABS(R_MAGNET)
-            #
-            #     i1 = 1
-            #     arg_ener = 0.5
-            #     arg_ang = 0.5
-            #     CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
-            #
-            #     print*,"RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG",RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG
-            #     !Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
-            #     print*,"ENER,ANGLEV: ",Q_WAVE*TOCM/TWOPI,ANGLEV
-            # END IF
-
-            # interpolate for the photon energy,vertical angle,and the degree of polarization.
-
-            wavelength = codata.h * codata.c / codata.e / sampled_photon_energy[itik]
-            Q_WAVE = 2 * numpy.pi / (wavelength*1e2)
-            ANGLEV = sampled_angle[itik]
-            POL_DEG = sampled_polarization[itik]
-
-
-            # IF (ANGLEV.LT.0.0) I_CHANGE = -1
-            # ANGLEV =   ANGLEV + E_BEAM(3)
-            if ANGLEV < 0:
-                I_CHANGE = -1
-            ANGLEV += E_BEAM3
-
-            # ------ NOT LONGER DONE ------
-            # ! C
-            # ! C Test if the ray is within the specified limits
-            # ! C
-            # IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
-            #     IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
-            #         ARG_ANG = WRAN(ISTAR1)
-            #         ! C
-            #         ! C If it is outside the range, then generate another ray.
-            #         ! C
-            #         GO TO 4400
-            #     END IF
-            # END IF
+        rays[:,0] = XXX
+        rays[:,1] = YYY
+        rays[:,2] = ZZZ
+
+        # ! C
+        # ! C Synchrotron source
+        # ! C Note. The angle of emission IN PLANE is the same as the one used
+        # ! C before. This will give rise to a source curved along the orbit.
+        # ! C The elevation angle is instead characteristic of the SR distribution.
+        # ! C The electron beam emittance is included at this stage. Note that if
+        # ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
+        # ! C
+        # ANGLEX =   ANGLE + E_BEAM(1)
+        # DIREC(1)  =   TAN(ANGLEX)
+        # IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
+        # DIREC(2)  =   1.0D0
+        # ARG_ANG  =   GRID(6,ITIK)
+
+        ANGLEX = ANGLE + E_BEAM1
+        DIREC1 = numpy.tan(ANGLEX)
+        if r_aladdin < 0:
+            DIREC1 *= -1.0
+        DIREC2 = numpy.ones(NRAYS)
+
+        # ! C
+        # ! C In the case of SR, we take into account the fact that the electron
+        # ! C trajectory is not orthogonal to the field. This will give a correction
+        # ! C to the photon energy.  We can write it as a correction to the
+        # ! C magnetic field strength; this will linearly shift the critical energy
+        # ! C and, with it, the energy of the emitted photon.
+        # ! C
+        # E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
+        # E_TEMP(2) =   1.0D0
+        # E_TEMP(1) =   TAN(E_BEAM(1))
+        # CALL NORM (E_TEMP,E_TEMP)
+        # CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
+        # 4400 CONTINUE
+        # (CORREC is not used: the photon energy is sampled from the energy distribution)
+
+        # IF (FDISTR.EQ.6) THEN ! exect synchtotron
+        #     CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
+        #     Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
+        #     POL_DEG =   ARG_ANG
+        # ELSE IF (FDISTR.EQ.4) THEN  ! synchrotron
+        #     print*,"R_MAGNET, DIREC",R_MAGNET,DIREC
+        #     ARG_ENER =   WRAN (ISTAR1)
+        #     RAD_MIN =   ABS(R_MAGNET)
+        #
+        #     i1 = 1
+        #     arg_ener = 0.5
+        #     arg_ang = 0.5
+        #     CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
+        #
+        #     print*,"RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG",RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG
+        #     !Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
+        #     print*,"ENER,ANGLEV: ",Q_WAVE*TOCM/TWOPI,ANGLEV
+        # END IF
+
+        # the vertical angle comes from the sampled angle distribution (photon energy and
+        # the degree of polarization are used below)
+
+        # IF (ANGLEV.LT.0.0) I_CHANGE = -1
+        # ANGLEV =   ANGLEV + E_BEAM(3)
+        ANGLEV = sampled_angle + E_BEAM3
 
+        # ------ NOT LONGER DONE ------
+        # ! C
+        # ! C Test if the ray is within the specified limits
+        # ! C
+        # IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
+        #     IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
+        #         ARG_ANG = WRAN(ISTAR1)
+        #         ! C
+        #         ! C If it is outside the range, then generate another ray.
+        #         ! C
+        #         GO TO 4400
+        #     END IF
+        # END IF
 
-            # DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
-            # CALL NORM (DIREC,DIREC)
 
-            DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
+        # DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
+        # CALL NORM (DIREC,DIREC)
 
-            DIREC_MOD = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
-            DIREC3 /= DIREC_MOD
-            DIREC2 /= DIREC_MOD
-            DIREC1 /= DIREC_MOD
+        DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
 
-            # print(">>>>DIREC,FGRID,R_ALADDIN: ",itik,DIREC1,DIREC2,DIREC3)
+        DIREC_MOD = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
 
-            rays[itik,3] = DIREC1
-            rays[itik,4] = DIREC2
-            rays[itik,5] = DIREC3
+        rays[:,3] = DIREC1 / DIREC_MOD
+        rays[:,4] = DIREC2 / DIREC_MOD
+        rays[:,5] = DIREC3 / DIREC_MOD
 
 
-            #
-            # electric field vectors (cols 7-9, 16-18) and phases (cols 14-15)
-            #
+        #
+        # electric field vectors (cols 7-9, 16-18) and phases (cols 14-15)
+        #
 
         # ! C
         # ! C  ---------------------------------------------------------------------
@@ -494,18 +443,6 @@ class S4BendingMagnetLightSource(LightSource, S4LightSource):
         # ! C Now the phases of A_VEC and AP_VEC.
         # ! C
 
-        #
-        POL_ANGLE = 0.5 * numpy.pi # TO BE CHECKED
-
-        if F_COHER == 1:
-            PHASEX = 0.0
-        else:
-            PHASEX = numpy.random.random(NRAYS) * 2 * numpy.pi
-
-        # PHASEZ = PHASEX + POL_ANGLE * numpy.sign(ANGLEV)
-
-        rays[:,13] = 0.0 # PHASEX
-        rays[:,14] = 0.0 # PHASEZ
 
         # set flag (col 10)
         rays[:,9] = 1.0
@@ -541,6 +478,24 @@ class S4BendingMagnetLightSource(LightSource, S4LightSource):
 
         return rays
 
+    @classmethod
+    def __sample_electron_phase_space(cls, epsi_w, sigma, sigma_p):
+        # samples (x, x') of the electron beam at a distance epsi_w (an array, one value per ray)
+        # from the waist, using the Cholesky decomposition of the per-ray covariance matrix
+        #     [[<x2>, <x x'>], [<x x'>, <x'2>]] = [[epsi_w^2 sigma_p^2 + sigma^2, epsi_w sigma_p^2], [epsi_w sigma_p^2, sigma_p^2]]
+        c11 = epsi_w**2 * sigma_p**2 + sigma**2
+        c12 = epsi_w * sigma_p**2
+        c22 = sigma_p**2
+
+        L11 = numpy.sqrt(c11)
+        L21 = numpy.zeros_like(L11)
+        non_zero = L11 != 0
+        L21[non_zero] = c12[non_zero] / L11[non_zero]
+        L22 = numpy.sqrt(numpy.maximum(c22 - L21**2, 0.0))
+
+        u = numpy.random.normal(size=(2, epsi_w.size))
+        return L11 * u[0], L21 * u[0] + L22 * u[1]
+
     @classmethod
     def __cross(cls, u, v):
         # w = u X v
@@ -359,7 +359,7 @@ class SourceGeometrical(object):
             # ! C Normalize so that each energy has a probability and so that the sum
             # ! C of the probabilities of all the energies is 1.
             # ! C
-            relative_intensities /= relative_intensities.sum()
+            relative_intensities = relative_intensities / relative_intensities.sum()
             # ! C
             # ! C Arrange the probabilities so that they comprise the (0,1) interval,
             # ! C e.g. (energy1,0.3), (energy2, 0.1), (energy3, 0.6) is translated to
@@ -368,20 +368,12 @@ class SourceGeometrical(object):
             # ! C photon energy.
             # ! C
 
-            TMP_B = 0
-            for i in range(relative_intensities.size):
-                TMP_B += relative_intensities[i]
-                relative_intensities[i] = TMP_B
+            cumulated_intensities = numpy.cumsum(relative_intensities)
 
-            sampled_values = numpy.zeros(N)
-            for i in range(N):
-                DPS_RAN3 = numpy.random.random()
-                if (DPS_RAN3 > 0. and DPS_RAN3 <= relative_intensities[0]):
-                    sampled_values[i] = values[0]
-
-                for j in range(1,values.size):
-                    if (DPS_RAN3 > relative_intensities[j-1] and DPS_RAN3 <= relative_intensities[j]):
-                        sampled_values[i] = values[j]
+            # the interval (cumulated_intensities[j-1], cumulated_intensities[j]] is assigned to values[j]
+            DPS_RAN3 = numpy.random.random(N)
+            index = numpy.searchsorted(cumulated_intensities, DPS_RAN3, side='left')
+            sampled_values = values[numpy.minimum(index, values.size - 1)]
 
             if self.__f_phot == 0:
                 rays[:,10] = self._energy_to_wavenumber(sampled_values)
@@ -22,6 +22,8 @@ rays = su.calculate_rays()    # sample rays. Result is a numpy.array of shape (N
 """
 
 
+import os
+import hashlib
 import numpy
 
 from srxraylib.util.inverse_method_sampler import Sampler1D, Sampler2D, Sampler3D
@@ -36,6 +38,7 @@ from shadow4.beam.beam import Beam
 from shadow4.sources.undulator.source_undulator_factory import SourceUndulatorFactory
 from shadow4.sources.undulator.source_undulator_factory_srw import SourceUndulatorFactorySrw
 from shadow4.sources.undulator.source_undulator_factory_pysru import SourceUndulatorFactoryPysru
+from shadow4.sources.undulator.source_undulator_input_output import SourceUndulatorInputOutput
 
 from shadow4.sources.undulator.s4_undulator import S4Undulator
 
@@ -46,15 +49,24 @@ INTEGRATION_METHOD = 1 # 0=sum, 1=trapz
 
 class S4UndulatorLightSource(LightSource, S4LightSource):
 
-    def __init__(self, name="Undefined", electron_beam=None, undulator_magnetic_structure=None):
+    def __init__(self, name="Undefined", electron_beam=None, undulator_magnetic_structure=None, number_of_workers=1,
+                 radiation_cache_directory=None):
         super().__init__(name,
                          electron_beam=electron_beam if not electron_beam is None else ElectronBeam(),
                          magnetic_structure=undulator_magnetic_structure if not undulator_magnetic_structure is None else S4Undulator())
 
+        # number of processes used to calculate the radiation at the different photon energies
+        # (1: no parallel calculation, None or 0: the number of cpus)
+        self.__number_of_workers = number_of_workers
+
+        # directory where the radiation (output of undul_phot) is stored in hdf5 files to be reused by other
+        # sources with the same parameters (None: no persistent cache)
+        self.__radiation_cache_directory = radiation_cache_directory
 
         # results of calculations
 
         self.__result_radiation = None
+        self.__result_sampler = None
         self.__result_photon_size_distribution = None
         self.__result_photon_size_sigma = None
 
@@ -63,6 +75,59 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
             user_unit_to_m=user_unit_to_m, F_COHER=F_COHER, NRAYS=NRAYS, SEED=SEED
             ))
 
+    def set_number_of_workers(self, number_of_workers=1):
+        """
+        Sets the number of processes used to calculate the radiation (the photon energies are distributed
+        among them). Use 1 (default) for a sequential calculation, or None (or 0) to use all the cpus.
+        """
+        self.__number_of_workers = number_of_workers
+
+    def get_number_of_workers(self):
+        return self.__number_of_workers
+
+    def set_radiation_cache_directory(self, radiation_cache_directory=None):
+        """
+        Sets a directory to store the calculated radiation (the output of undul_phot) in hdf5 files. A file is
+        reused (instead of recalculating the radiation) by any source with the same electron energy and current,
+        undulator, grids and calculation code. None (default) disables the persistent cache.
+        """
+        self.__radiation_cache_directory = radiation_cache_directory
+
+    def get_radiation_cache_directory(self):
+        return self.__radiation_cache_directory
+
+    def get_radiation_cache_key(self):
+        """
+        Returns a hash of all the parameters used to calculate the radiation.
+        """
+        syned_electron_beam = self.get_electron_beam()
+        undulator = self.get_magnetic_structure()
+
+        parameters = ("undul_phot", 1, # version of the file contents
+                      undulator.code_undul_phot.lower(),
+                      repr(float(syned_electron_beam.energy())),
+                      repr(float(syned_electron_beam.current())),
+                      repr(float(undulator.period_length())),
+                      repr(float(undulator.number_of_periods())),
+                      repr(float(undulator.K())),
+                      repr(float(undulator._EMIN)),
+                      repr(float(undulator._EMAX)),
+                      int(undulator._NG_E),
+                      repr(float(undulator._MAXANGLE)),
+                      int(undulator._NG_T),
+                      int(undulator._NG_P),
+                      int(undulator._NG_J) if undulator.code_undul_phot == 'internal' else None)
+
+        return hashlib.sha1(repr(parameters).encode()).hexdigest()
+
+    def get_radiation_cache_filename(self):
+        """
+        Returns the name of the hdf5 file with the radiation in the persistent cache (None if the cache is not used).
+        """
+        if self.__radiation_cache_directory is None:
+            return None
+        return os.path.join(self.__radiation_cache_directory, "undul_phot_%s.h5" % self.get_radiation_cache_key())
+
     def info(self,debug=False):
         syned_electron_beam = self.get_electron_beam()
         undulator = self.get_magnetic_structure()
@@ -221,6 +286,18 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
         undulator = self.get_magnetic_structure()
 
         self.__result_radiation = None
+        self.__result_sampler = None
+
+        cache_filename = self.get_radiation_cache_filename()
+        if cache_filename is not None and os.path.exists(cache_filename):
+            try:
+                undul_phot_dict = SourceUndulatorInputOutput.load_file_undul_phot_h5(cache_filename)
+                print("Radiation loaded from file: %s" % cache_filename)
+                undul_phot_dict["info"] = self.info()
+                self.__result_radiation = undul_phot_dict
+                return
+            except Exception as e:
+                print("Failed to load radiation from file %s (%s): recalculating" % (cache_filename, str(e)))
 
         # undul_phot
         if undulator.code_undul_phot == 'internal':
@@ -235,7 +312,8 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
                                          MAXANGLE  = undulator._MAXANGLE,
                                          NG_T      = undulator._NG_T,
                                          NG_P      = undulator._NG_P,
-                                         number_of_trajectory_points = undulator._NG_J)
+                                         number_of_trajectory_points = undulator._NG_J,
+                                         number_of_workers = self.__number_of_workers)
 
         elif undulator.code_undul_phot == 'pysru' or  undulator.code_undul_phot == 'pySRU':
             undul_phot_dict = SourceUndulatorFactoryPysru.undul_phot(E_ENERGY  = syned_electron_beam.energy(),
@@ -248,9 +326,10 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
                                          NG_E      = undulator._NG_E,
                                          MAXANGLE  = undulator._MAXANGLE,
                                          NG_T      = undulator._NG_T,
-                                         NG_P      = undulator._NG_P,)
+                                         NG_P      = undulator._NG_P,
+                                         number_of_workers = self.__number_of_workers)
         elif undulator.code_undul_phot == 'srw' or  undulator.code_undul_phot == 'SRW':
-            undul_phot_dict = SourceUndulatorFactorySrw.undul_phot(E_ENERGY  = self.syned_electron_beam.energy(),
+            undul_phot_dict = SourceUndulatorFactorySrw.undul_phot(E_ENERGY  = syned_electron_beam.energy(),
                                          INTENSITY = syned_electron_beam.current(),
                                          LAMBDAU   = undulator.period_length(),
                                          NPERIODS  = undulator.number_of_periods(),
@@ -260,7 +339,8 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
                                          NG_E      = undulator._NG_E,
                                          MAXANGLE  = undulator._MAXANGLE,
                                          NG_T      = undulator._NG_T,
-                                         NG_P      = undulator._NG_P,)
+                                         NG_P      = undulator._NG_P,
+                                         number_of_workers = self.__number_of_workers)
         else:
             raise Exception("Not implemented undul_phot code: "+undulator.code_undul_phot)
 
@@ -268,6 +348,13 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
         undul_phot_dict["code_undul_phot"] = undulator.code_undul_phot
         undul_phot_dict["info"] = self.info()
 
+        if cache_filename is not None:
+            os.makedirs(self.__radiation_cache_directory, exist_ok=True)
+            # write to a temporary file and rename it, so other processes never read an incomplete file
+            tmp_filename = "%s.%d.tmp" % (cache_filename, os.getpid())
+            SourceUndulatorInputOutput.write_file_undul_phot_h5(undul_phot_dict, file_out=tmp_filename)
+            os.replace(tmp_filename, cache_filename)
+
         self.__result_radiation = undul_phot_dict
 
     #
@@ -782,6 +869,20 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
         # sample divergences
         #
 
+        # the sampler (with the normalized radiation and its cdfs) is created once for the current radiation
+        if self.__result_sampler is None:
+            self.__result_sampler = self.__create_sampler()
+
+        if isinstance(self.__result_sampler, Sampler2D):
+            sampled_theta,sampled_phi = self.__result_sampler.get_n_sampled_points(NRAYS)
+            sampled_photon_energy = self.get_magnetic_structure()._EMIN
+        else:
+            sampled_photon_energy,sampled_theta,sampled_phi = self.__result_sampler.get_n_sampled_points(NRAYS)
+
+        return sampled_photon_energy,sampled_theta,sampled_phi
+
+    def __create_sampler(self):
+
         theta = self.__result_radiation["theta"]
         phi = self.__result_radiation["phi"]
         photon_energy = self.__result_radiation["photon_energy"]
@@ -792,42 +893,24 @@ class S4UndulatorLightSource(LightSource, S4LightSource):
         if self.get_magnetic_structure()._NG_E == 1:
             photon_energy_spectrum = 'monochromatic'
 
+        # correct radiation for DxDz / DthetaDphi
+        tmp_theta = numpy.outer(theta,numpy.ones_like(phi))
+        tmp_theta /= tmp_theta.max()
+        tmp_theta += 1e-6 # to avoid zeros
+        # plot_image(tmp_theta,theta,phi,aspect='auto')
 
         if photon_energy_spectrum == 'monochromatic':
-
             #2D case
             tmp = self.__result_radiation["radiation"][0, :, :].copy()
             tmp /= tmp.max()
-
-            # correct radiation for DxDz / DthetaDphi
-            tmp_theta = numpy.outer(theta,numpy.ones_like(phi))
-            tmp_theta /= tmp_theta.max()
-            tmp_theta += 1e-6 # to avoid zeros
             tmp *= tmp_theta
-            # plot_image(tmp_theta,theta,phi,aspect='auto')
-
-            s2d = Sampler2D(tmp,theta,phi)
-            sampled_theta,sampled_phi = s2d.get_n_sampled_points(NRAYS)
-
-            sampled_photon_energy = self.get_magnetic_structure()._EMIN
-
-        elif photon_energy_spectrum == "polychromatic":
+            return Sampler2D(tmp,theta,phi)
+        else:
             #3D case
             tmp = self.__result_radiation["radiation"].copy()
             tmp /= tmp.max()
-            # correct radiation for DxDz / DthetaDphi
-            tmp_theta = numpy.outer(theta,numpy.ones_like(phi))
-            tmp_theta /= tmp_theta.max()
-            tmp_theta += 1e-6 # to avoid zeros
-            for i in range(tmp.shape[0]):
-                tmp[i,:,:] *= tmp_theta
-
-            s3d = Sampler3D(tmp,photon_energy,theta,phi)
-
-            sampled_photon_energy,sampled_theta,sampled_phi = s3d.get_n_sampled_points(NRAYS)
-
-
-        return sampled_photon_energy,sampled_theta,sampled_phi
+            tmp *= tmp_theta[numpy.newaxis,:,:]
+            return Sampler3D(tmp,photon_energy,theta,phi)
 
 
 if __name__ == "__main__":
@@ -16,6 +16,7 @@ __date__ = "12/01/2017"
 # Available public methods:
 #
 #     undul_phot()       : like undul_phot of SHADOW but written in python with internal code hacked from pySRU
+#                          (the photon energies can be calculated in parallel using number_of_workers > 1)
 #     undul_cdf          : like undul_cdf in SHADOW written internally in python
 #
 #
@@ -29,6 +30,8 @@ import numpy as np
 import scipy.constants as codata
 import scipy.integrate
 
+from shadow4.tools.parallel import map_in_processes, split_indices, get_number_of_workers
+
 class SourceUndulatorFactory(object):
 
     #
@@ -67,23 +70,35 @@ class SourceUndulatorFactory(object):
     # adapted from pySRU:  energy_radiated_approximation_and_farfield()
     @staticmethod
     def _pysru_energy_radiated_approximation_and_farfield(omega=2.53465927101*10**17,electron_current=1.0,trajectory=np.zeros((11,10)) , x=0.00 , y=0.0, D=None):
+        return SourceUndulatorFactory._pysru_energy_radiated_approximation_and_farfield_batch(omega=omega,
+                                            electron_current=electron_current, trajectory=trajectory,
+                                            x=np.array([x]), y=np.array([y]), D=D)[:,0]
+
+    # batched version of _pysru_energy_radiated_approximation_and_farfield(): the electric field is computed
+    # for all the observation points (arrays x and y) at once. The integrals along the trajectory are done
+    # for blocks of points, so that no more than chunk_size (points x trajectory points) values are stored.
+    # returns the field as an array (3,npoints)
+    @staticmethod
+    def _pysru_energy_radiated_approximation_and_farfield_batch(omega=2.53465927101*10**17,electron_current=1.0,trajectory=np.zeros((11,10)),
+                                                              x=np.zeros(1), y=np.zeros(1), D=None, chunk_size=1000000):
 
         c6 = codata.e * electron_current * 1e-9 / (8.0 * np.pi ** 2 * codata.epsilon_0 * codata.c * codata.h)
 
         if D is not None:
             c6 /= D**2
 
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+
         N = trajectory.shape[1]
-        # N = trajectory.nb_points()
-        if D == None:
+        if D is None:
             # in radian :
             n_chap = np.array([x, y, 1.0 - 0.5 * (x ** 2 + y ** 2)])
             X = np.sqrt(x ** 2 + y ** 2 )#TODO a changer
         #in meters :
         else :
             X = np.sqrt(x ** 2 + y ** 2 + D ** 2)
-            n_chap = np.array([x, y, D]) / X
-
+            n_chap = np.array([x, y, np.full_like(x, D)]) / X
 
         trajectory_t   = trajectory[0]
         trajectory_x   = trajectory[1]
@@ -92,50 +107,92 @@ class SourceUndulatorFactory(object):
         trajectory_v_x = trajectory[4]
         trajectory_v_y = trajectory[5]
         trajectory_v_z = trajectory[6]
-        # trajectory_a_x = trajectory[7]
-        # trajectory_a_y = trajectory[8]
-        # trajectory_a_z = trajectory[9]
-
-        E = np.zeros((3,), dtype=np.complex)
-        integrand = np.zeros((3, N), dtype=np.complex)
-        A1 = (n_chap[1] * trajectory_v_z - n_chap[2] * trajectory_v_y)
-        A2 = (-n_chap[0] * trajectory_v_z + n_chap[2] * trajectory_v_x)
-        A3 = (n_chap[0] * trajectory_v_y - n_chap[1] * trajectory_v_x)
-        Alpha2 = np.exp(
-            0. + 1j * omega * (trajectory_t + X / codata.c - n_chap[0] * trajectory_x
-                                               - n_chap[1] * trajectory_y - n_chap[2] * trajectory_z))
-
-
-        integrand[0] -= ( n_chap[1]*A3 - n_chap[2]*A2) * Alpha2
-        integrand[1] -= (- n_chap[0]*A3 + n_chap[2]*A1) * Alpha2
-        integrand[2] -= ( n_chap[0]*A2 - n_chap[1]*A1) * Alpha2
-
-        for k in range(3):
-            # E[k] = np.trapz(integrand[k], self.trajectory.t)
-            E[k] = np.trapz(integrand[k], trajectory_t)
-        E *= omega * 1j
-
-        terme_bord = np.full((3), 0. + 1j * 0., dtype=np.complex)
-        Alpha_1 = (1.0 / (1.0 - n_chap[0] * trajectory_v_x[-1]
-                          - n_chap[1] * trajectory_v_y[-1] - n_chap[2] * trajectory_v_z[-1]))
-        Alpha_0 = (1.0 / (1.0 - n_chap[0] * trajectory_v_x[0]
-                          - n_chap[1] * trajectory_v_y[0] - n_chap[2] * trajectory_v_z[0]))
-
-        terme_bord += ((n_chap[1] * A3[-1] - n_chap[2] * A2[-1]) * Alpha_1 *
-                       Alpha2[-1])
-        terme_bord -= ((n_chap[1] * A3[0] - n_chap[2] * A2[0]) * Alpha_0 *
-                       Alpha2[0])
-        E += terme_bord
+
+        # the integrand is -(n_chap x (n_chap x v)) * Alpha2 = -(n_chap (n_chap . v) - |n_chap|^2 v) * Alpha2, so
+        # only the three integrals of v_x, v_y, v_z times Alpha2 are needed. They are computed
+        # as a matrix product with the weights of the trapezoidal rule.
+        dt = np.diff(trajectory_t)
+        trapz_weights = np.zeros(N)
+        trapz_weights[:-1] += 0.5 * dt
+        trapz_weights[1:] += 0.5 * dt
+        V = np.vstack((trajectory_v_x, trajectory_v_y, trajectory_v_z)).T * trapz_weights[:, np.newaxis] # (N,3)
+
+        E = np.zeros((3, x.size), dtype=complex)
+        step = max(1, chunk_size // N)
+        for i0 in range(0, x.size, step):
+            i1 = min(i0 + step, x.size)
+            n0 = n_chap[0, i0:i1, np.newaxis]
+            n1 = n_chap[1, i0:i1, np.newaxis]
+            n2 = n_chap[2, i0:i1, np.newaxis]
+
+            # array (points, trajectory points)
+            Alpha2 = np.exp(
+                0. + 1j * omega * (trajectory_t + X[i0:i1, np.newaxis] / codata.c - n0 * trajectory_x
+                                                   - n1 * trajectory_y - n2 * trajectory_z))
+
+            integral_v = Alpha2 @ V # (points,3)
+            n = n_chap[:, i0:i1].T  # (points,3)
+            n_dot_integral_v = (n * integral_v).sum(axis=1)
+            n_squared = (n ** 2).sum(axis=1)
+            E[:, i0:i1] = -(n * n_dot_integral_v[:, np.newaxis] - n_squared[:, np.newaxis] * integral_v).T
+
+            E[:, i0:i1] *= omega * 1j
+
+            # boundary term, the same for the three components (as in pySRU)
+            n0 = n0[:, 0]
+            n1 = n1[:, 0]
+            n2 = n2[:, 0]
+            A2_1 = (-n0 * trajectory_v_z[-1] + n2 * trajectory_v_x[-1])
+            A3_1 = (n0 * trajectory_v_y[-1] - n1 * trajectory_v_x[-1])
+            A2_0 = (-n0 * trajectory_v_z[0] + n2 * trajectory_v_x[0])
+            A3_0 = (n0 * trajectory_v_y[0] - n1 * trajectory_v_x[0])
+            Alpha_1 = (1.0 / (1.0 - n0 * trajectory_v_x[-1]
+                              - n1 * trajectory_v_y[-1] - n2 * trajectory_v_z[-1]))
+            Alpha_0 = (1.0 / (1.0 - n0 * trajectory_v_x[0]
+                              - n1 * trajectory_v_y[0] - n2 * trajectory_v_z[0]))
+
+            terme_bord = ((n1 * A3_1 - n2 * A2_1) * Alpha_1 * Alpha2[:, -1])
+            terme_bord -= ((n1 * A3_0 - n2 * A2_0) * Alpha_0 * Alpha2[:, 0])
+            E[:, i0:i1] += terme_bord
+
         E *= c6**0.5
         return E
 
 
+    # calculates the radiation and polarization (arrays (energies,theta,phi)) for a set of photon energies
+    # (E in eV, omega_array in rad/s) in the observation points X,Y (arrays (theta,phi)) at distance D.
+    # first_index and total are only used for displaying the progress.
+    @staticmethod
+    def _undul_phot_energies(E, omega_array, first_index, total, INTENSITY, T, X, Y, D):
+        Z2 = np.zeros((omega_array.size,) + X.shape)
+        POL_DEG = np.zeros_like(Z2)
+
+        for o in range(omega_array.size):
+            print("Calculating energy %8.3f eV (%d of %d)"%(E[o],first_index+o+1,total))
+            ElecField = SourceUndulatorFactory._pysru_energy_radiated_approximation_and_farfield_batch(omega=omega_array[o],
+                                                        electron_current=INTENSITY,trajectory=T , x=X , y=Y, D=D )
+            ElecFieldAbs = np.abs(ElecField)
+
+            # pol_deg = ElecFieldAbs[0]**2 / (ElecFieldAbs[0]**2 + ElecFieldAbs[1]**2)
+            pol_deg = ElecFieldAbs[0] / (ElecFieldAbs[0] + ElecFieldAbs[1]) # SHADOW definition
+            intensity =  (ElecFieldAbs[0] ** 2 + ElecFieldAbs[1] ** 2 + ElecFieldAbs[2] ** 2)
+
+
+            #  Conversion from pySRU units (photons/mm^2/0.1%bw) to SHADOW units (photons/rad^2/eV)
+            intensity *= (D*1e3)**2 # photons/mm^2 -> photons/rad^2
+            intensity /= 1e-3 * E[o] # photons/o.1%bw -> photons/eV
+
+            Z2[o] = intensity.reshape(X.shape)
+            POL_DEG[o] = pol_deg.reshape(X.shape)
+
+        return Z2, POL_DEG
+
     #
     # now, the different versions of undul_phot
     #
     @staticmethod
     def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,
-                   number_of_trajectory_points=20):
+                   number_of_trajectory_points=20, number_of_workers=1):
 
 
         #
@@ -161,29 +218,20 @@ class SourceUndulatorFactory(object):
         theta = np.linspace(0,MAXANGLE,NG_T,dtype=float)
         phi = np.linspace(0,np.pi/2,NG_P,dtype=float)
 
-        Z2 = np.zeros((omega_array.size,theta.size,phi.size))
-        POL_DEG = np.zeros_like(Z2)
-        for o in range(omega_array.size):
-            print("Calculating energy %8.3f eV (%d of %d)"%(E[o],o+1,omega_array.size))
-            for t in range(theta.size):
-                for p in range(phi.size):
-                    R = D / np.cos(theta[t])
-                    r = R * np.sin(theta[t])
-                    X = r * np.cos(phi[p])
-                    Y = r * np.sin(phi[p])
-                    ElecField = SourceUndulatorFactory._pysru_energy_radiated_approximation_and_farfield(omega=omega_array[o],electron_current=INTENSITY,trajectory=T , x=X , y=Y, D=D )
-
-                    # pol_deg = np.abs(ElecField[0])**2 / (np.abs(ElecField[0])**2 + np.abs(ElecField[1])**2)
-                    pol_deg = np.abs(ElecField[0]) / (np.abs(ElecField[0]) + np.abs(ElecField[1])) # SHADOW definition
-                    intensity =  (np.abs(ElecField[0]) ** 2 + np.abs(ElecField[1])** 2 + np.abs(ElecField[2])** 2)
-
+        # observation points (all theta and phi)
+        R = D / np.cos(theta)
+        r = R * np.sin(theta)
+        X = np.outer(r, np.cos(phi))
+        Y = np.outer(r, np.sin(phi))
 
-                    #  Conversion from pySRU units (photons/mm^2/0.1%bw) to SHADOW units (photons/rad^2/eV)
-                    intensity *= (D*1e3)**2 # photons/mm^2 -> photons/rad^2
-                    intensity /= 1e-3 * E[o] # photons/o.1%bw -> photons/eV
+        # the energies are independent: they can be calculated in parallel (by slices of contiguous energies)
+        slices = split_indices(E.size, get_number_of_workers(number_of_workers))
+        results = map_in_processes(SourceUndulatorFactory._undul_phot_energies,
+                                   [(E[i0:i1], omega_array[i0:i1], i0, E.size, INTENSITY, T, X, Y, D) for i0, i1 in slices],
+                                   number_of_workers=number_of_workers)
 
-                    Z2[o,t,p] = intensity
-                    POL_DEG[o,t,p] = pol_deg
+        Z2 = np.concatenate([result[0] for result in results], axis=0)
+        POL_DEG = np.concatenate([result[1] for result in results], axis=0)
 
         return {'radiation':Z2,'polarization':POL_DEG,'photon_energy':E,'theta':theta,'phi':phi,'trajectory':T}
 
@@ -206,11 +254,7 @@ class SourceUndulatorFactory(object):
         print("undul_cdf: _NG_E,_NG_T,_NG_P, %d  %d %d \n"%(NG_E,NG_T,NG_P))
 
         # coordinates are polar: multiply by sin(theta) to allow dS= r^2 sin(Theta) dTheta dPhi
-        YRN0 = numpy.zeros_like(RN0)
-        for e in numpy.arange(NG_E):
-            for t in numpy.arange(NG_T):
-                for p in numpy.arange(NG_P):
-                    YRN0[e,t,p] = RN0[e,t,p] * numpy.sin(T[t])
+        YRN0 = RN0 * numpy.sin(T)[numpy.newaxis,:,numpy.newaxis]
 
 
         if method == "sum":
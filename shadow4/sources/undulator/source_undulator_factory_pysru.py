@@ -14,6 +14,7 @@ __date__ = "12/01/2017"
 # Available public function:
 #
 #     undul_phot_pysru() : like undul_phot of SHADOW but using pySRU
+#                          (the photon energies can be calculated in parallel using number_of_workers > 1)
 #
 #
 
@@ -31,34 +32,25 @@ from pySRU.RadiationFactory import RADIATION_METHOD_APPROX_FARFIELD
 # except:
 #     print("Failed to import pySRU")
 
+from shadow4.tools.parallel import map_in_processes, split_indices, get_number_of_workers
+
 class SourceUndulatorFactoryPysru(object):
 
+    # calculates the radiation, polarization (arrays (energies,theta,phi)) and the trajectory for a set of
+    # photon energies in the observation points X,Y (arrays (theta,phi)) at distance D.
+    # first_index and total are only used for displaying the progress.
     @staticmethod
-    def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P):
+    def _undul_phot_energies(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,photon_energy,first_index,total,X,Y,D):
 
         myelectronbeam = PysruElectronBeam(Electron_energy=E_ENERGY, I_current=INTENSITY)
         myundulator = PysruUndulator(K=K, period_length=LAMBDAU, length=LAMBDAU*NPERIODS)
 
-        #
-        # polar grid matrix
-        #
-        photon_energy = np.linspace(EMIN,EMAX,NG_E,dtype=float)
-
-        intens = np.zeros((NG_E,NG_T,NG_P))
+        intens = np.zeros((photon_energy.size,) + X.shape)
         pol_deg = np.zeros_like(intens)
-        theta = np.linspace(0,MAXANGLE,NG_T,dtype=float)
-        phi = np.linspace(0,np.pi/2,NG_P,dtype=float)
-
-        D = 100.0 # placed far away (100 m)
-
-        THETA = np.outer(theta,np.ones_like(phi))
-        PHI = np.outer(np.ones_like(theta),phi)
-
-        X = (D / np.cos(THETA)) * np.sin(THETA) * np.cos(PHI)
-        Y = (D / np.cos(THETA)) * np.sin(THETA) * np.sin(PHI)
+        T = None
 
         for ie,e in enumerate(photon_energy):
-            print("Calculating energy %g eV (%d of %d)"%(e,ie+1,photon_energy.size))
+            print("Calculating energy %g eV (%d of %d)"%(e,first_index+ie+1,total))
             simulation_test = create_simulation(magnetic_structure=myundulator,electron_beam=myelectronbeam,
                                                 magnetic_field=None, photon_energy=e,
                                                 traj_method=TRAJECTORY_METHOD_ANALYTIC,Nb_pts_trajectory=None,
@@ -77,8 +69,8 @@ class SourceUndulatorFactoryPysru(object):
             pol_deg1 = (np.abs(E[:,0]) / (np.abs(E[:,0]) + np.abs(E[:,1]))).flatten() # SHADOW definition!!
 
             intens1 = simulation_test.radiation.intensity.copy()
-            intens1.shape = (theta.size,phi.size)
-            pol_deg1.shape = (theta.size,phi.size)
+            intens1.shape = X.shape
+            pol_deg1.shape = X.shape
 
             #  Conversion from pySRU units (photons/mm^2/0.1%bw) to SHADOW units (photons/rad^2/eV)
             intens1 *= (D*1e3)**2 # photons/mm^2 -> photons/rad^2
@@ -90,6 +82,36 @@ class SourceUndulatorFactoryPysru(object):
             T0 = simulation_test.trajectory
             T = np.vstack((T0.t,T0.x,T0.y,T0.z,T0.v_x,T0.v_y,T0.v_z,T0.a_x,T0.a_y,T0.a_z))
 
-        return {'radiation':intens,'polarization':pol_deg,'photon_energy':photon_energy,'theta':theta,'phi':phi,'trajectory':T}
+        return intens, pol_deg, T
 
+    @staticmethod
+    def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,number_of_workers=1):
 
+        #
+        # polar grid matrix
+        #
+        photon_energy = np.linspace(EMIN,EMAX,NG_E,dtype=float)
+
+        theta = np.linspace(0,MAXANGLE,NG_T,dtype=float)
+        phi = np.linspace(0,np.pi/2,NG_P,dtype=float)
+
+        D = 100.0 # placed far away (100 m)
+
+        THETA = np.outer(theta,np.ones_like(phi))
+        PHI = np.outer(np.ones_like(theta),phi)
+
+        X = (D / np.cos(THETA)) * np.sin(THETA) * np.cos(PHI)
+        Y = (D / np.cos(THETA)) * np.sin(THETA) * np.sin(PHI)
+
+        # the energies are independent: they can be calculated in parallel (by slices of contiguous energies)
+        slices = split_indices(photon_energy.size, get_number_of_workers(number_of_workers))
+        results = map_in_processes(SourceUndulatorFactoryPysru._undul_phot_energies,
+                                   [(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,photon_energy[i0:i1],i0,photon_energy.size,X,Y,D)
+                                    for i0, i1 in slices],
+                                   number_of_workers=number_of_workers)
+
+        intens = np.concatenate([result[0] for result in results], axis=0)
+        pol_deg = np.concatenate([result[1] for result in results], axis=0)
+        T = results[-1][2] # the trajectory does not depend on the photon energy
+
+        return {'radiation':intens,'polarization':pol_deg,'photon_energy':photon_energy,'theta':theta,'phi':phi,'trajectory':T}
@@ -15,6 +15,7 @@ __date__ = "12/01/2017"
 # Available public funcmethodtion:
 #
 #     undul_phot()   : like undul_phot of SHADOW but using SRW
+#                      (the photon energies can be calculated in parallel using number_of_workers > 1)
 #
 #
 
@@ -32,6 +33,8 @@ import numpy
 import sys
 from scipy import interpolate
 
+from shadow4.tools.parallel import map_in_processes, split_indices, get_number_of_workers
+
 
 class SourceUndulatorFactorySrw(object):
 
@@ -137,16 +140,12 @@ class SourceUndulatorFactorySrw(object):
       x = numpy.linspace(stk.mesh.xStart,stk.mesh.xFin,stk.mesh.nx)
       y = numpy.linspace(stk.mesh.yStart,stk.mesh.yFin,stk.mesh.ny)
       e = numpy.linspace(stk.mesh.eStart,stk.mesh.eFin,stk.mesh.ne)
-      Z2 = numpy.zeros((e.size,x.size,y.size))
-      POL_DEG = numpy.zeros((e.size,x.size,y.size))
-      for ie in range(e.size):
-          for ix in range(x.size):
-              for iy in range(y.size):
-                Z2[ie,ix,iy] = data0[iy,ix,ie]
-                # this is shadow definition, that uses POL_DEG = |Ex|/(|Ex|+|Ey|)
-                Ex = numpy.sqrt(numpy.abs(0.5*(data0[iy,ix,ie]+data1[iy,ix,ie])))
-                Ey = numpy.sqrt(numpy.abs(0.5*(data0[iy,ix,ie]-data1[iy,ix,ie])))
-                POL_DEG[ie,ix,iy] =  Ex / (Ex + Ey)
+      # (e,x,y) views of the Stokes buffer (no copy)
+      Z2 = data0.transpose((2,1,0))
+      # this is shadow definition, that uses POL_DEG = |Ex|/(|Ex|+|Ey|)
+      Ex = numpy.sqrt(numpy.abs(0.5*(data0+data1)))
+      Ey = numpy.sqrt(numpy.abs(0.5*(data0-data1)))
+      POL_DEG = (Ex / (Ex + Ey)).transpose((2,1,0))
       return Z2,POL_DEG,e,x,y
 
     @staticmethod
@@ -195,11 +194,48 @@ class SourceUndulatorFactorySrw(object):
             z1 = tck(x1,y1)
             return z1
 
+    # calculates with SRW the radiation and polarization on a cartesian grid for the energies from emin to emax.
+    # returns radiation,pol_deg,e,x,y (see _srw_stokes0_to_arrays)
+    @staticmethod
+    def _srw_radiation_arrays(nperiods,lambdau,B,e_energy,intensity,sx,sz,xxp,zzp,sxp,szp,sE,
+                              emin,emax,ne,slit_xmin,slit_xmax,nx,slit_zmin,slit_zmax,nz,slit_distance,
+                              method="SE",params=[1, 0.01, 0, 0, 50000, 1, 0]):
+        print("nperiods: %d, lambdau: %f, B: %f)"%(nperiods,lambdau,B))
+
+        und = SourceUndulatorFactorySrw._srw_simple_undulator(nperiods,lambdau,B)
+        print("e=%f,Iavg=%f,sigX=%f,sigY=%f,mixX=%f,mixY=%f,sigXp=%f,sigYp=%f,sigE=%f"%(e_energy,intensity,sx,sz,xxp,zzp,sxp,szp,sE) )
+        eBeam = SourceUndulatorFactorySrw._srw_electron_beam(e=e_energy,Iavg=intensity,sigX=sx,sigY=sz,mixX=xxp,mixY=zzp,sigXp=sxp,sigYp=szp,sigE=sE)
+
+
+        cnt = SourceUndulatorFactorySrw._srw_undulators(und, 0., 0., 0.)
+        sys.stdout.flush()
+
+        mesh = sl.SRWLRadMesh(emin,emax,ne,slit_xmin,slit_xmax,nx,slit_zmin,slit_zmax,nz,slit_distance)
+        if (method == 'SE'):
+            print ("Calculating SE...")
+            stkSE, eBeam = SourceUndulatorFactorySrw._srw_single_electron_source(eBeam, cnt, mesh, params)
+            sys.stdout.write('  done\n')
+            sys.stdout.write('  saving SE Stokes...'); sys.stdout.flush()
+            stk = stkSE
+        else:
+            print ("Calculating ME...")
+            stkME, eBeam = SourceUndulatorFactorySrw._srw_multi_electron_source(eBeam, und) # cnt, mesh, params)
+            sys.stdout.write('  done\n')
+            sys.stdout.write('  saving SE Stokes...'); sys.stdout.flush()
+            stk = stkME
+
+        #
+        # dump file with radiation on cartesian grid
+        #
+        # _srw_stokes0_to_spec(stk,fname="srw_xshundul.spec")
+
+        return SourceUndulatorFactorySrw._srw_stokes0_to_arrays(stk)
+
     #
     # now, the public undul_phot
     #
     @staticmethod
-    def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P):
+    def undul_phot(E_ENERGY,INTENSITY,LAMBDAU,NPERIODS,K,EMIN,EMAX,NG_E,MAXANGLE,NG_T,NG_P,number_of_workers=1):
 
         lambdau = LAMBDAU
         k = K
@@ -279,34 +315,21 @@ class SourceUndulatorFactorySrw(object):
         #
         # calculations
         #
-        print("nperiods: %d, lambdau: %f, B: %f)"%(nperiods,lambdau,B))
-
-        und = SourceUndulatorFactorySrw._srw_simple_undulator(nperiods,lambdau,B)
-        print("e=%f,Iavg=%f,sigX=%f,sigY=%f,mixX=%f,mixY=%f,sigXp=%f,sigYp=%f,sigE=%f"%(e_energy,intensity,sx,sz,xxp,zzp,sxp,szp,sE) )
-        eBeam = SourceUndulatorFactorySrw._srw_electron_beam(e=e_energy,Iavg=intensity,sigX=sx,sigY=sz,mixX=xxp,mixY=zzp,sigXp=sxp,sigYp=szp,sigE=sE)
-
-
-        cnt = SourceUndulatorFactorySrw._srw_undulators(und, 0., 0., 0.)
-        sys.stdout.flush()
-
-        mesh = sl.SRWLRadMesh(emin,emax,ne,slit_xmin,slit_xmax,nx,slit_zmin,slit_zmax,nz,slit_distance)
-        if (method == 'SE'):
-            print ("Calculating SE...")
-            stkSE, eBeam = SourceUndulatorFactorySrw._srw_single_electron_source(eBeam, cnt, mesh, params)
-            sys.stdout.write('  done\n')
-            sys.stdout.write('  saving SE Stokes...'); sys.stdout.flush()
-            stk = stkSE
-        else:
-            print ("Calculating ME...")
-            stkME, eBeam = SourceUndulatorFactorySrw._srw_multi_electron_source(eBeam, und) # cnt, mesh, params)
-            sys.stdout.write('  done\n')
-            sys.stdout.write('  saving SE Stokes...'); sys.stdout.flush()
-            stk = stkME
-
-        #
-        # dump file with radiation on cartesian grid
+        # the energies are independent: they can be calculated in parallel (by slices of contiguous energies)
         #
-        # _srw_stokes0_to_spec(stk,fname="srw_xshundul.spec")
+        e = numpy.linspace(emin,emax,ne)
+        slices = split_indices(ne, get_number_of_workers(number_of_workers))
+        results = map_in_processes(SourceUndulatorFactorySrw._srw_radiation_arrays,
+                                   [(nperiods,lambdau,B,e_energy,intensity,sx,sz,xxp,zzp,sxp,szp,sE,
+                                     e[i0],e[i1-1],i1-i0,slit_xmin,slit_xmax,nx,slit_zmin,slit_zmax,nz,slit_distance,
+                                     method,params) for i0, i1 in slices],
+                                   number_of_workers=number_of_workers)
+
+        radiation = numpy.concatenate([result[0] for result in results], axis=0)
+        pol_deg = numpy.concatenate([result[1] for result in results], axis=0)
+        e = numpy.concatenate([result[2] for result in results])
+        x = results[0][3]
+        y = results[0][4]
 
         #
         # interpolate for polar grid
@@ -319,24 +342,21 @@ class SourceUndulatorFactorySrw(object):
         POL_DEG = numpy.zeros((NG_E,NG_T,NG_P))
 
         # interpolate on polar grid
-        radiation,pol_deg,e,x,y = SourceUndulatorFactorySrw._srw_stokes0_to_arrays(stk)
+        R = slit_distance / numpy.cos(theta)
+        r = R * numpy.sin(theta)
+        X = numpy.outer(r, numpy.cos(phi)).ravel()
+        Y = numpy.outer(r, numpy.sin(phi)).ravel()
         for ie in range(e.size):
           tck = SourceUndulatorFactorySrw._srw_interpol_object(x,y,radiation[ie])
           tck_pol_deg = SourceUndulatorFactorySrw._srw_interpol_object(x,y,pol_deg[ie])
-          for itheta in range(theta.size):
-            for iphi in range(phi.size):
-              R = slit_distance / numpy.cos(theta[itheta])
-              r = R * numpy.sin(theta[itheta])
-              X = r * numpy.cos(phi[iphi])
-              Y = r * numpy.sin(phi[iphi])
-              tmp = tck(X,Y)
-
-              #  Conversion from SRW units (photons/mm^2/0.1%bw) to SHADOW units (photons/rad^2/eV)
-              tmp *= (slit_distance*1e3)**2 # photons/mm^2 -> photons/rad^2
-              tmp /= 1e-3 * e[ie] # photons/o.1%bw -> photons/eV
-
-              Z2[ie,itheta,iphi] = tmp
-              POL_DEG[ie,itheta,iphi] = tck_pol_deg(X,Y)
+          tmp = tck.ev(X,Y)
+
+          #  Conversion from SRW units (photons/mm^2/0.1%bw) to SHADOW units (photons/rad^2/eV)
+          tmp *= (slit_distance*1e3)**2 # photons/mm^2 -> photons/rad^2
+          tmp /= 1e-3 * e[ie] # photons/o.1%bw -> photons/eV
+
+          Z2[ie] = tmp.reshape((NG_T,NG_P))
+          POL_DEG[ie] = tck_pol_deg.ev(X,Y).reshape((NG_T,NG_P))
 
         # !C SHADOW defines the degree of polarization by |E| instead of |E|^2
         # !C i.e.  P = |Ex|/(|Ex|+|Ey|)   instead of   |Ex|^2/(|Ex|^2+|Ey|^2)
@@ -22,53 +22,13 @@ class SourceUndulatorInputOutput(object):
         :return: a dictionary {'radiation':RN0, 'polarization':POL_DEG, 'photon_energy':E, 'theta':TT, 'phi':PP}
         """
 
-        f = open(file_in,'r')
-        firstline = f.readline()
-        f.close()
-
-        NG_E,NG_T,NG_P = numpy.fromstring(firstline,dtype=int,sep=" ")
-
-
-        tmp = numpy.loadtxt(file_in,skiprows=1)
+        (NG_E,NG_T,NG_P), tmp = SourceUndulatorInputOutput._read_text_file(file_in, 3)
 
         if tmp.size != 3*(NG_E*NG_T*NG_P)+NG_E+NG_E*NG_T:
             raise Exception("load_uphot_dot_dat: File not understood")
 
-        E = numpy.zeros(NG_E)
-        T = numpy.zeros((NG_E,NG_T))
-        P = numpy.zeros((NG_E,NG_T,NG_P))
-
-
-        itmp = 0
-        for ie in range(NG_E):
-            E[ie] = tmp[itmp]
-            itmp += 1
-
-        for ie in range(NG_E):
-            for it in range(NG_T):
-                T[ie,it] = tmp[itmp]
-                itmp += 1
-
-        for ie in range(NG_E):
-            for it in range(NG_T):
-                for ip in range(NG_P):
-                    P[ie,it,ip] = tmp[itmp]
-                    itmp += 1
-
-        RN0 = numpy.zeros((NG_E,NG_T,NG_P))
-        POL_DEG = numpy.zeros((NG_E,NG_T,NG_P))
-
-        for e in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    RN0[e,t,p] = tmp[itmp]
-                    itmp += 1
-
-        for e in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    POL_DEG[e,t,p] = tmp[itmp]
-                    itmp += 1
+        E, T, P, RN0, POL_DEG = SourceUndulatorInputOutput._split(tmp,
+                                    [(NG_E,), (NG_E,NG_T), (NG_E,NG_T,NG_P), (NG_E,NG_T,NG_P), (NG_E,NG_T,NG_P)])
 
         TT = T.flatten()[0:NG_T].copy()
         PP = P.flatten()[0:NG_P].copy()
@@ -97,28 +57,11 @@ class SourceUndulatorInputOutput(object):
 
         f = open(file_out,'w')
         f.write("%d  %d  %d \n"%(NG_E,NG_T,NG_P))
-        for ie in range(NG_E):
-            f.write("%20.10f \n"%(e[ie]))
-
-        for ie in range(NG_E):
-            for t in range(NG_T):
-                f.write("%20.10f \n"%(theta[t]))
-
-        for ie in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    f.write("%20.10f \n"%(phi[p]))
-
-
-        for ie in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    f.write("%20.10f \n"%Z2[ie,t,p])
-
-        for ie in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    f.write("%20.10f \n"%(POL_DEG[ie,t,p]))
+        SourceUndulatorInputOutput._write_values(f, e)
+        SourceUndulatorInputOutput._write_values(f, numpy.tile(theta, NG_E))
+        SourceUndulatorInputOutput._write_values(f, numpy.tile(phi, NG_E * NG_T))
+        SourceUndulatorInputOutput._write_values(f, Z2)
+        SourceUndulatorInputOutput._write_values(f, POL_DEG)
 
         f.close()
         print("File written to disk: %s"%file_out)
@@ -161,11 +104,38 @@ class SourceUndulatorInputOutput(object):
         f1["polarization"] = POL_DEG
         f1["code_undul_phot"] = undul_phot_dict["code_undul_phot"]
         f1["info"] = undul_phot_dict["info"]
+        if undul_phot_dict.get("trajectory", None) is not None:
+            f1["trajectory"] = undul_phot_dict["trajectory"]
 
 
         f.close()
         print("File written to disk: %s"%file_out)
 
+    @staticmethod
+    def load_file_undul_phot_h5(file_in="uphot.h5",entry_name="radiation",mmap=False):
+        """
+        read a file written by write_file_undul_phot_h5
+
+        :param file_in: name of the file to be read
+        :param entry_name: name of the group with the data (Default: radiation)
+        :param mmap: if True, the arrays are memory-mapped (read-only) instead of read (when the
+                dataset is stored contiguous and uncompressed)
+        :return: a dictionary {'radiation':RN0, 'polarization':POL_DEG, 'photon_energy':E, 'theta':TT, 'phi':PP,
+                'code_undul_phot':code, 'info':info} (and 'trajectory' if stored in the file)
+        """
+
+        out = {}
+        with h5py.File(file_in,'r') as f:
+            f1 = f[entry_name]
+            for key in ['radiation','polarization','photon_energy','theta','phi','trajectory']:
+                if key in f1:
+                    out[key] = SourceUndulatorInputOutput._read_h5_dataset(f1[key], file_in, mmap=mmap)
+            for key in ['code_undul_phot','info']:
+                value = f1[key][()]
+                out[key] = value.decode() if isinstance(value, bytes) else value
+
+        return out
+
     @staticmethod
     def load_file_undul_cdf(file_in="xshundul.sha"):
         """
@@ -176,65 +146,14 @@ class SourceUndulatorInputOutput(object):
                 'energy':E,'theta':T,'phi':P,'polarization':POL_DEGREE}
         """
 
-        f = open(file_in,'r')
-        firstline = f.readline()
-        f.close()
-
-        NG_E,NG_T,NG_P, IANGLE = numpy.fromstring(firstline,dtype=int,sep=" ")
-
-
-        tmp = numpy.loadtxt(file_in,skiprows=1)
+        (NG_E,NG_T,NG_P, IANGLE), tmp = SourceUndulatorInputOutput._read_text_file(file_in, 4)
 
         if tmp.size != 2*(NG_E + NG_E*NG_T + NG_E*NG_T*NG_P) + NG_E*NG_T*NG_P:
             raise Exception("File not understood")
 
-        E = numpy.zeros(NG_E)
-        T = numpy.zeros((NG_E,NG_T))
-        P = numpy.zeros((NG_E,NG_T,NG_P))
-
-
-        itmp = 0
-        for ie,e in enumerate(E):
-            E[ie] = tmp[itmp]
-            itmp += 1
-
-        for ie in range(NG_E):
-            for it in range(NG_T):
-                T[ie,it] = tmp[itmp]
-                itmp += 1
-
-        for ie in range(NG_E):
-            for it in range(NG_T):
-                for ip in range(NG_P):
-                    P[ie,it,ip] = tmp[itmp]
-                    itmp += 1
-
-        TWO = numpy.zeros((NG_E))
-        ONE = numpy.zeros((NG_E,NG_T))
-        ZERO = numpy.zeros((NG_E,NG_T,NG_P))
-        POL_DEGREE = numpy.zeros_like(ZERO)
-
-
-        for e in range(NG_E):
-            TWO[e] = tmp[itmp]
-            itmp += 1
-
-        for e in range(NG_E):
-            for t in range(NG_T):
-                ONE[e,t] = tmp[itmp]
-                itmp += 1
-
-        for e in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    ZERO[e,t,p] = tmp[itmp]
-                    itmp += 1
-
-        for e in range(NG_E):
-            for t in range(NG_T):
-                for p in range(NG_P):
-                    POL_DEGREE[e,t,p] = tmp[itmp]
-                    itmp += 1
+        E, T, P, TWO, ONE, ZERO, POL_DEGREE = SourceUndulatorInputOutput._split(tmp,
+                                    [(NG_E,), (NG_E,NG_T), (NG_E,NG_T,NG_P),
+                                     (NG_E,), (NG_E,NG_T), (NG_E,NG_T,NG_P), (NG_E,NG_T,NG_P)])
 
         return {'cdf_EnergyThetaPhi':TWO,'cdf_EnergyTheta':ONE,'cdf_Energy':ZERO,'energy':E,'theta':T,'phi':P,'polarization':POL_DEGREE}
 
@@ -266,35 +185,13 @@ class SourceUndulatorInputOutput(object):
             f = open(file_out,'w')
             f.write("%d  %d  %d 1 \n"%(NG_E,NG_T,NG_P))
 
-            for e in E:
-                f.write("%20.10f \n"%(e))
-
-            for e in E:
-                for t in T:
-                    f.write("%20.10f \n"%t)
-
-            for e in E:
-                for t in T:
-                    for p in P:
-                        f.write("%20.10f \n"%p)
-
-            for e in numpy.arange(NG_E):
-                f.write("%20.10f \n"%(TWO[e]))
-
-            for e in numpy.arange(NG_E):
-                for t in numpy.arange(NG_T):
-                    f.write("%20.10f \n"%(ONE[e,t]))
-
-            for e in numpy.arange(NG_E):
-                for t in numpy.arange(NG_T):
-                    for p in numpy.arange(NG_P):
-                        f.write("%20.10f \n"%(ZERO[e,t,p]))
-
-            for e in numpy.arange(NG_E):
-                for t in numpy.arange(NG_T):
-                    for p in numpy.arange(NG_P):
-                        f.write("%20.10f \n"%(POL_DEG[e,t,p]))
-
+            SourceUndulatorInputOutput._write_values(f, E)
+            SourceUndulatorInputOutput._write_values(f, numpy.tile(T, NG_E))
+            SourceUndulatorInputOutput._write_values(f, numpy.tile(P, NG_E * NG_T))
+            SourceUndulatorInputOutput._write_values(f, TWO)
+            SourceUndulatorInputOutput._write_values(f, ONE)
+            SourceUndulatorInputOutput._write_values(f, ZERO)
+            SourceUndulatorInputOutput._write_values(f, POL_DEG)
 
             f.close()
             print("File written to disk: %s"%file_out)
@@ -358,6 +255,65 @@ class SourceUndulatorInputOutput(object):
 
 
 
+    @staticmethod
+    def load_file_undul_cdf_h5(file_in="cdf.h5",entry_name="cdf",mmap=False):
+        """
+        read a file written by write_file_undul_cdf_h5
+
+        :param file_in: name of the file to be read
+        :param entry_name: name of the group with the data (Default: cdf)
+        :param mmap: if True, the arrays are memory-mapped (read-only) instead of read (when the
+                dataset is stored contiguous and uncompressed)
+        :return: a dictionary {'cdf_EnergyThetaPhi':TWO,'cdf_EnergyTheta':ONE,'cdf_Energy':ZERO,
+                'energy':E,'theta':T,'phi':P,'polarization':POL_DEGREE}
+        """
+
+        out = {}
+        with h5py.File(file_in,'r') as f:
+            f1 = f[entry_name]
+            for key in ['cdf_EnergyThetaPhi','cdf_EnergyTheta','cdf_Energy','energy','theta','phi','polarization']:
+                out[key] = SourceUndulatorInputOutput._read_h5_dataset(f1[key], file_in, mmap=mmap)
+
+        return out
+
+    #
+    # bulk i/o helpers
+    #
+    @staticmethod
+    def _read_text_file(file_in, n_header):
+        # returns the n_header integers in the first line and an array with all the other values in the file
+        with open(file_in,'r') as f:
+            firstline = f.readline()
+            body = f.read()
+        header = numpy.fromstring(firstline,dtype=int,sep=" ")[0:n_header]
+        return header, numpy.fromstring(body,dtype=float,sep=" ")
+
+    @staticmethod
+    def _split(values, shapes):
+        # splits the 1D array values in consecutive blocks with the given shapes
+        out = []
+        itmp = 0
+        for shape in shapes:
+            n = int(numpy.prod(shape))
+            out.append(values[itmp:itmp+n].reshape(shape).copy())
+            itmp += n
+        return out
+
+    @staticmethod
+    def _write_values(f, values):
+        # writes the values (in C order), one per line, with the SHADOW format
+        values = numpy.asarray(values, dtype=float).ravel()
+        f.write(("%20.10f \n" * values.size) % tuple(values))
+
+    @staticmethod
+    def _read_h5_dataset(dataset, file_in, mmap=False):
+        # reads a dataset, or memory-maps it if requested and possible (contiguous, not compressed)
+        if mmap and dataset.shape != () and dataset.chunks is None and dataset.compression is None:
+            offset = dataset.id.get_offset()
+            if offset is not None:
+                return numpy.memmap(file_in, mode='r', dtype=dataset.dtype, shape=dataset.shape, offset=offset)
+        return dataset[()]
+
     @staticmethod
     def plot_undul_phot(undul_phot_input,do_plot_intensity=True,do_plot_polarization=True,do_show=True,title=""):
         #
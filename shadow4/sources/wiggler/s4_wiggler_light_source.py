@@ -409,337 +409,241 @@ class S4WigglerLightSource(LightSource, S4LightSource):
 
 
 
-        for itik in range(NRAYS):
-
-            #     ARG_Y = GRID(2,ITIK)
-            #     CALL SPL_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
-            arg_y = numpy.random.random() # ARG_Y[itik]
-            Y_TRAJ = SEED_Y(arg_y)
-
-
-            #     ! srio@esrf.eu 2014-05-19
-            #     ! in wiggler some problems arise because spl_int
-            #     ! does not return a Y value in the correct range.
-            #     ! In those cases, we make a linear interpolation instead.
-            #     if ((y_traj.le.y_temp(1)).or.(y_traj.gt.y_temp(NP_SY))) then
-            #         y_traj_old = y_traj
-            #         CALL LIN_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
-            #         print*,'SOURCESYNC: bad y_traj from SPL_INT, corrected with LIN_SPL: ',y_traj_old,'=>',y_traj
-            #     endif
-            #
-            #     CALL SPL_INT (Y_X,    NP_TRAJ, Y_TRAJ, X_TRAJ,    IER)
-            #     CALL SPL_INT (Y_XPRI, NP_TRAJ, Y_TRAJ, ANGLE,     IER)
-            #     CALL SPL_INT (Y_CURV, NP_TRAJ, Y_TRAJ, CURV,      IER)
-            #     CALL SPL_INT (Y_PATH, NP_TRAJ, Y_TRAJ, EPSI_PATH, IER)
-            # END IF
-
-            X_TRAJ = Y_X(Y_TRAJ)
-            ANGLE = Y_XPRI(Y_TRAJ)
-            CURV = Y_CURV(Y_TRAJ)
-            EPSI_PATH = Y_PATH(Y_TRAJ)
-
-            # print("\n>>><<<",arg_y,Y_TRAJ,X_TRAJ,ANGLE,CURV,EPSI_PATH)
-
-
-            # EPSI_PATH = EPSI_PATH - PATH0 ! now refer to wiggler's origin
-            # IF (CURV.LT.0) THEN
-            #     POL_ANGLE = 90.0D0  ! instant orbit is CW
-            # ELSE
-            #     POL_ANGLE = -90.0D0  !     CCW
-            # END IF
-            # IF (CURV.EQ.0) THEN
-            #     R_MAGNET = 1.0D+20
-            # ELSE
-            #     R_MAGNET = ABS(1.0D0/CURV)
-            # END IF
-            # POL_ANGLE  = TORAD*POL_ANGLE
-
-            EPSI_PATH = EPSI_PATH - PATH0 # now refer to wiggler's origin
-            if CURV < 0:
-                POL_ANGLE = 90.0 # instant orbit is CW
-            else:
-                POL_ANGLE = -90.0 # CCW
-
-            if CURV == 0.0:
-                R_MAGNET = 1.0e20
-            else:
-                R_MAGNET = numpy.abs(1.0/CURV)
-
-            POL_ANGLE  = POL_ANGLE * numpy.pi / 180.0
-
-            # ! C
-            # ! C Compute the actual distance (EPSI_W*) from the orbital focus
-            # ! C
-            EPSI_WX = EPSI_DX + EPSI_PATH
-            EPSI_WZ = EPSI_DZ + EPSI_PATH
-
-
-            # ! BUG srio@esrf.eu found that these routine does not make the
-            # ! calculation correctly. Changed to new one BINORMAL
-            # !CALL GAUSS (SIGMAX, EPSI_X, EPSI_WX, XXX, E_BEAM(1), istar1)
-            # !CALL GAUSS (SIGMAZ, EPSI_Z, EPSI_WZ, ZZZ, E_BEAM(3), istar1)
-            # !
-            # ! calculation of the electrom beam moments at the current position
-            # ! (sX,sZ) = (epsi_wx,epsi_ez):
-            # ! <x2> = sX^2 + sigmaX^2
-            # ! <x x'> = sX sigmaXp^2
-            # ! <x'2> = sigmaXp^2                 (same for Z)
-            #
-            # ! then calculate the new recalculated sigmas (rSigmas) and correlation rho of the
-            # ! normal bivariate distribution at the point in the electron trajectory
-            # ! rsigmaX  = sqrt(<x2>)
-            # ! rsigmaXp = sqrt(<x'2>)
-            # ! rhoX =  <x x'>/ (rsigmaX rsigmaXp)      (same for Z)
-            #
-            # if (abs(sigmaX) .lt. 1e-15) then  !no emittance
-            #     sigmaXp = 0.0d0
-            #     XXX = 0.0
-            #     E_BEAM(1) = 0.0
-            # else
-            #     sigmaXp = epsi_Xold/sigmaX    ! true only at waist, use epsi_xOld as it has been redefined :(
-            #     rSigmaX = sqrt( (epsi_wX**2) * (sigmaXp**2) + sigmaX**2 )
-            #     rSigmaXp = sigmaXp
-            #     if (abs(rSigmaX*rSigmaXp) .lt. 1e-15) then  !no emittance
-            #         rhoX = 0.0
-            #     else
-            #         rhoX = epsi_wx * sigmaXp**2 / (rSigmaX * rSigmaXp)
-            #     endif
-            #
-            #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
-            # endif
-            #
-
-            if wiggler._FLAG_EMITTANCE:
-                #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
-                #     [  c11  c12  ]     [  sigma1^2           rho*sigma1*sigma2   ]
-                #     [  c21  c22  ]  =  [  rho*sigma1*sigma2  sigma2^2            ]
-                sigmaX,sigmaXp,sigmaZ,sigmaZp = syned_electron_beam.get_sigmas_all()
-
-                epsi_wX = sigmaX * sigmaXp
-                rSigmaX = numpy.sqrt( (epsi_wX**2) * (sigmaXp**2) + sigmaX**2 )
-                rSigmaXp = sigmaXp
-                rhoX = epsi_wX * sigmaXp**2 / (rSigmaX * rSigmaXp)
-                mean = [0, 0]
-                cov = [[sigmaX**2, rhoX*sigmaX*sigmaXp], [rhoX*sigmaX*sigmaXp, sigmaXp**2]]  # diagonal covariance
-                sampled_x, sampled_xp = numpy.random.multivariate_normal(mean, cov, 1).T
-                # plot_scatter(sampled_x,sampled_xp)
-                XXX = sampled_x
-                E_BEAM1 = sampled_xp
-
-                epsi_wZ = sigmaZ * sigmaZp
-                rSigmaZ = numpy.sqrt( (epsi_wZ**2) * (sigmaZp**2) + sigmaZ**2 )
-                rSigmaZp = sigmaZp
-                rhoZ = epsi_wZ * sigmaZp**2 / (rSigmaZ * rSigmaZp)
-                mean = [0, 0]
-                cov = [[sigmaZ**2, rhoZ*sigmaZ*sigmaZp], [rhoZ*sigmaZ*sigmaZp, sigmaZp**2]]  # diagonal covariance
-                sampled_z, sampled_zp = numpy.random.multivariate_normal(mean, cov, 1).T
-                ZZZ = sampled_z
-                E_BEAM3 = sampled_zp
-
-            else:
-                sigmaXp = 0.0
-                XXX = 0.0
-                E_BEAM1 = 0.0
-                rhoX = 0.0
-                sigmaZp = 0.0
-                ZZZ = 0.0
-                E_BEAM3 = 0.0
-
-            #
-            # ! C
-            # ! C For normal wiggler, XXX is perpendicular to the electron trajectory at
-            # ! C the point defined by (X_TRAJ,Y_TRAJ,0).
-            # ! C
-            # IF (F_WIGGLER.EQ.1) THEN   ! normal wiggler
-            #     YYY = Y_TRAJ - XXX*SIN(ANGLE)
-            #     XXX = X_TRAJ + XXX*COS(ANGLE)
-
-            YYY = Y_TRAJ - XXX * numpy.sin(ANGLE)
-            XXX = X_TRAJ + XXX * numpy.cos(ANGLE)
-
-            rays[itik,0] = XXX
-            rays[itik,1] = YYY
-            rays[itik,2] = ZZZ
-
-            #
-            # directions
-            #
-
-            #     ! C
-            #     ! C Synchrotron source
-            #     ! C Note. The angle of emission IN PLANE is the same as the one used
-            #     ! C before. This will give rise to a source curved along the orbit.
-            #     ! C The elevation angle is instead characteristic of the SR distribution.
-            #     ! C The electron beam emittance is included at this stage. Note that if
-            #     ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
-            #     ! C
-            #     IF (F_WIGGLER.EQ.3) ANGLE=0        ! Elliptical Wiggler.
-            #     ANGLEX =   ANGLE + E_BEAM(1)
-            #     DIREC(1)  =   TAN(ANGLEX)
-            #     IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
-            #     DIREC(2)  =   1.0D0
-            #     ARG_ANG  =   GRID(6,ITIK)
-
-            ANGLEX = ANGLE + E_BEAM1
-            DIREC1 = numpy.tan(ANGLEX)
-            DIREC2 = 1.0
-
-
-            #     ! C
-            #     ! C In the case of SR, we take into account the fact that the electron
-            #     ! C trajectory is not orthogonal to the field. This will give a correction
-            #     ! C to the photon energy.  We can write it as a correction to the
-            #     ! C magnetic field strength; this will linearly shift the critical energy
-            #     ! C and, with it, the energy of the emitted photon.
-            #     ! C
-            #     E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
-            #     E_TEMP(2) =   1.0D0
-            #     E_TEMP(1) =   TAN(E_BEAM(1))
-            #     CALL NORM (E_TEMP,E_TEMP)
-            #     CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
-            #     4400 CONTINUE
-
-            E_TEMP3 = numpy.tan(E_BEAM3)/numpy.cos(E_BEAM1)
-            E_TEMP2 = 1.0
-            E_TEMP1 = numpy.tan(E_BEAM1)
-
-            e_temp_norm = numpy.sqrt( E_TEMP1**2 + E_TEMP2**2 + E_TEMP3**2)
-
-            E_TEMP3 /= e_temp_norm
-            E_TEMP2 /= e_temp_norm
-            E_TEMP1 /= e_temp_norm
-
-
-            CORREC = numpy.sqrt(1.0 - E_TEMP3**2)
-
-
-            #     IF (FDISTR.EQ.6) THEN
-            #         CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
-            #         Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
-            #         POL_DEG =   ARG_ANG
-            #     ELSE IF (FDISTR.EQ.4) THEN
-            #         ARG_ENER =   WRAN (ISTAR1)
-            #         RAD_MIN =   ABS(R_MAGNET)
-            #
-            #         i1 = 1
-            #         CALL WHITE  &
-            #         (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
-            #     END IF
-
-            RAD_MIN = numpy.abs(R_MAGNET)
-
-
-            # CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
-            ARG_ANG = numpy.random.random()
-            ARG_ENER = numpy.random.random()
-
-
-            # print("   >> R_MAGNET, DIREC",R_MAGNET,DIREC1,DIREC2)
-            # print("   >> RAD_MIN,CORREC,ARG_ENER,ARG_ANG,",RAD_MIN,CORREC,ARG_ENER,ARG_ANG)
-
-#######################################################################
-            # gamma = self.syned_electron_beam.gamma()
-            # m2ev = codata.c * codata.h / codata.e
-            # TOANGS = m2ev * 1e10
-            # critical_energy = TOANGS*3.0*numpy.power(gamma,3)/4.0/numpy.pi/1.0e10*(1.0/RAD_MIN)
-
-            # sampled_photon_energy = sampled_energies[itik]
-            # wavelength = codata.h * codata.c / codata.e /sampled_photon_energy
-            # Q_WAVE = 2 * numpy.pi / (wavelength*1e2)
-            # print("   >> PHOTON ENERGY, Ec, lambda, Q: ",sampled_photon_energy,critical_energy,wavelength*1e10,Q_WAVE)
-###################################################################################
-            sampled_photon_energy = sampled_energies[itik]
-            # wavelength = codata.h * codata.c / codata.e /sampled_photon_energy
-            critical_energy = TOANGS * 3.0 * numpy.power(gamma, 3) / 4.0 / numpy.pi / 1.0e10 * (1.0 / RAD_MIN)
-            eene = sampled_photon_energy / critical_energy
-
-            # TODO: remove old after testing...
-            method = "new"
-
-            if method == "old":
-                # fm = sync_f(a*1e-3*self.syned_electron_beam.gamma(),eene,polarization=0) * \
-                #     numpy.power(eene,2)*a8*self.syned_electron_beam._current*hdiv_mrad * \
-                #     numpy.power(self.syned_electron_beam._energy_in_GeV,2)
-
-                fm_s = sync_f(a*1e-3*self.syned_electron_beam.gamma(),eene,polarization=1) * \
-                    numpy.power(eene,2)*a8*self.syned_electron_beam._current*hdiv_mrad * \
-                    numpy.power(self.syned_electron_beam._energy_in_GeV,2)
-
-                fm_p = sync_f(a*1e-3*self.syned_electron_beam.gamma(),eene,polarization=2) * \
-                    numpy.power(eene,2)*a8*self.syned_electron_beam._current*hdiv_mrad * \
-                    numpy.power(self.syned_electron_beam._energy_in_GeV,2)
-            else:
-                fm_s , fm_p = sync_f_sigma_and_pi(a*1e-3*syned_electron_beam.gamma(),eene)
-                cte = eene ** 2 * a8 * syned_electron_beam._current * hdiv_mrad * syned_electron_beam._energy_in_GeV ** 2
-                fm_s *= cte
-                fm_p *= cte
-
-            fm = fm_s + fm_p
-
-            fm_pol = numpy.zeros_like(fm)
-            for i in range(fm_pol.size):
-                if fm[i] == 0.0:
-                    fm_pol[i] = 0
-                else:
-                    fm_pol[i] = fm_s[i] / fm[i]
-
-            fm.shape = -1
-            fm_s.shape = -1
-            fm_pol.shape = -1
-
-
-            pol_deg_interpolator = interp1d(a*1e-3,fm_pol)
-
-            samplerAng = Sampler1D(fm,a*1e-3)
+        #     ARG_Y = GRID(2,ITIK)
+        #     CALL SPL_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
+        arg_y = numpy.random.random(NRAYS) # ARG_Y[itik]
+        Y_TRAJ = SEED_Y(arg_y)
+
+
+        #     ! srio@esrf.eu 2014-05-19
+        #     ! in wiggler some problems arise because spl_int
+        #     ! does not return a Y value in the correct range.
+        #     ! In those cases, we make a linear interpolation instead.
+        #     if ((y_traj.le.y_temp(1)).or.(y_traj.gt.y_temp(NP_SY))) then
+        #         y_traj_old = y_traj
+        #         CALL LIN_INT (SEED_Y, NP_SY,   ARG_Y,  Y_TRAJ,    IER)
+        #         print*,'SOURCESYNC: bad y_traj from SPL_INT, corrected with LIN_SPL: ',y_traj_old,'=>',y_traj
+        #     endif
+        #
+        #     CALL SPL_INT (Y_X,    NP_TRAJ, Y_TRAJ, X_TRAJ,    IER)
+        #     CALL SPL_INT (Y_XPRI, NP_TRAJ, Y_TRAJ, ANGLE,     IER)
+        #     CALL SPL_INT (Y_CURV, NP_TRAJ, Y_TRAJ, CURV,      IER)
+        #     CALL SPL_INT (Y_PATH, NP_TRAJ, Y_TRAJ, EPSI_PATH, IER)
+        # END IF
+
+        X_TRAJ = Y_X(Y_TRAJ)
+        ANGLE = Y_XPRI(Y_TRAJ)
+        CURV = Y_CURV(Y_TRAJ)
+        EPSI_PATH = Y_PATH(Y_TRAJ)
+
+
+        # EPSI_PATH = EPSI_PATH - PATH0 ! now refer to wiggler's origin
+        # IF (CURV.LT.0) THEN
+        #     POL_ANGLE = 90.0D0  ! instant orbit is CW
+        # ELSE
+        #     POL_ANGLE = -90.0D0  !     CCW
+        # END IF
+        # IF (CURV.EQ.0) THEN
+        #     R_MAGNET = 1.0D+20
+        # ELSE
+        #     R_MAGNET = ABS(1.0D0/CURV)
+        # END IF
+        # POL_ANGLE  = TORAD*POL_ANGLE
+
+        EPSI_PATH = EPSI_PATH - PATH0 # now refer to wiggler's origin
+        POL_ANGLE = numpy.where(CURV < 0, 90.0, -90.0) # CW / CCW instant orbit
+        POL_ANGLE  = POL_ANGLE * numpy.pi / 180.0
+
+        R_MAGNET = numpy.full(NRAYS, 1.0e20)
+        non_zero = CURV != 0.0
+        R_MAGNET[non_zero] = numpy.abs(1.0 / CURV[non_zero])
 
-            # samplerPol = Sampler1D(fm_s/fm,a*1e-3)
+        # ! C
+        # ! C Compute the actual distance (EPSI_W*) from the orbital focus
+        # ! C
+        EPSI_WX = EPSI_DX + EPSI_PATH
+        EPSI_WZ = EPSI_DZ + EPSI_PATH
+
+
+        # ! BUG srio@esrf.eu found that these routine does not make the
+        # ! calculation correctly. Changed to new one BINORMAL
+        # !CALL GAUSS (SIGMAX, EPSI_X, EPSI_WX, XXX, E_BEAM(1), istar1)
+        # !CALL GAUSS (SIGMAZ, EPSI_Z, EPSI_WZ, ZZZ, E_BEAM(3), istar1)
+        # !
+        # ! calculation of the electrom beam moments at the current position
+        # ! (sX,sZ) = (epsi_wx,epsi_ez):
+        # ! <x2> = sX^2 + sigmaX^2
+        # ! <x x'> = sX sigmaXp^2
+        # ! <x'2> = sigmaXp^2                 (same for Z)
+        #
+        # ! then calculate the new recalculated sigmas (rSigmas) and correlation rho of the
+        # ! normal bivariate distribution at the point in the electron trajectory
+        # ! rsigmaX  = sqrt(<x2>)
+        # ! rsigmaXp = sqrt(<x'2>)
+        # ! rhoX =  <x x'>/ (rsigmaX rsigmaXp)      (same for Z)
+        #
+        # if (abs(sigmaX) .lt. 1e-15) then  !no emittance
+        #     sigmaXp = 0.0d0
+        #     XXX = 0.0
+        #     E_BEAM(1) = 0.0
+        # else
+        #     sigmaXp = epsi_Xold/sigmaX    ! true only at waist, use epsi_xOld as it has been redefined :(
+        #     rSigmaX = sqrt( (epsi_wX**2) * (sigmaXp**2) + sigmaX**2 )
+        #     rSigmaXp = sigmaXp
+        #     if (abs(rSigmaX*rSigmaXp) .lt. 1e-15) then  !no emittance
+        #         rhoX = 0.0
+        #     else
+        #         rhoX = epsi_wx * sigmaXp**2 / (rSigmaX * rSigmaXp)
+        #     endif
+        #
+        #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
+        # endif
+        #
 
-            # plot(a*1e-3,fm_s/fm)
+        if wiggler._FLAG_EMITTANCE:
+            #     CALL BINORMAL (rSigmaX, rSigmaXp, rhoX, XXX, E_BEAM(1), istar1)
+            #     [  c11  c12  ]     [  sigma1^2           rho*sigma1*sigma2   ]
+            #     [  c21  c22  ]  =  [  rho*sigma1*sigma2  sigma2^2            ]
+            sigmaX,sigmaXp,sigmaZ,sigmaZp = syned_electron_beam.get_sigmas_all()
+
+            epsi_wX = sigmaX * sigmaXp
+            rSigmaX = numpy.sqrt( (epsi_wX**2) * (sigmaXp**2) + sigmaX**2 )
+            rSigmaXp = sigmaXp
+            rhoX = epsi_wX * sigmaXp**2 / (rSigmaX * rSigmaXp)
+            mean = [0, 0]
+            cov = [[sigmaX**2, rhoX*sigmaX*sigmaXp], [rhoX*sigmaX*sigmaXp, sigmaXp**2]]  # diagonal covariance
+            sampled_x, sampled_xp = numpy.random.multivariate_normal(mean, cov, NRAYS).T
+            # plot_scatter(sampled_x,sampled_xp)
+            XXX = sampled_x
+            E_BEAM1 = sampled_xp
+
+            epsi_wZ = sigmaZ * sigmaZp
+            rSigmaZ = numpy.sqrt( (epsi_wZ**2) * (sigmaZp**2) + sigmaZ**2 )
+            rSigmaZp = sigmaZp
+            rhoZ = epsi_wZ * sigmaZp**2 / (rSigmaZ * rSigmaZp)
+            mean = [0, 0]
+            cov = [[sigmaZ**2, rhoZ*sigmaZ*sigmaZp], [rhoZ*sigmaZ*sigmaZp, sigmaZp**2]]  # diagonal covariance
+            sampled_z, sampled_zp = numpy.random.multivariate_normal(mean, cov, NRAYS).T
+            ZZZ = sampled_z
+            E_BEAM3 = sampled_zp
 
-            if fm.min() == fm.max():
-                print("Warning: cannot compute divergence for ray index %d"%itik)
-                sampled_theta = 0.0
-            else:
-                sampled_theta = samplerAng.get_sampled(ARG_ENER)
+        else:
+            XXX = numpy.zeros(NRAYS)
+            E_BEAM1 = numpy.zeros(NRAYS)
+            ZZZ = numpy.zeros(NRAYS)
+            E_BEAM3 = numpy.zeros(NRAYS)
 
-            sampled_pol_deg = pol_deg_interpolator(sampled_theta)
+        #
+        # ! C
+        # ! C For normal wiggler, XXX is perpendicular to the electron trajectory at
+        # ! C the point defined by (X_TRAJ,Y_TRAJ,0).
+        # ! C
+        # IF (F_WIGGLER.EQ.1) THEN   ! normal wiggler
+        #     YYY = Y_TRAJ - XXX*SIN(ANGLE)
+        #     XXX = X_TRAJ + XXX*COS(ANGLE)
 
+        YYY = Y_TRAJ - XXX * numpy.sin(ANGLE)
+        XXX = X_TRAJ + XXX * numpy.cos(ANGLE)
 
-            # print("sampled_theta: ",sampled_theta, "sampled_energy: ",sampled_photon_energy, "sampled pol ",sampled_pol_deg)
+        rays[:,0] = XXX
+        rays[:,1] = YYY
+        rays[:,2] = ZZZ
 
-            ANGLEV = sampled_theta
-            ANGLEV += E_BEAM3
-            #     IF (ANGLEV.LT.0.0) I_CHANGE = -1
-            #     ANGLEV =   ANGLEV + E_BEAM(3)
-            #     ! C
-            #     ! C Test if the ray is within the specified limits
-            #     ! C
-            #     IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
-            #         IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
-            #             ARG_ANG = WRAN(ISTAR1)
-            #             ! C
-            #             ! C If it is outside the range, then generate another ray.
-            #             ! C
-            #             GO TO 4400
-            #         END IF
-            #     END IF
-            #     DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
+        #
+        # directions
+        #
 
-            DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
-            #     IF (F_WIGGLER.EQ.3) THEN
-            #         CALL ROTATE (DIREC, ANGLE3,ANGLE2,ANGLE1,DIREC)
-            #     END IF
-            #     CALL NORM (DIREC,DIREC)
+        #     ! C
+        #     ! C Synchrotron source
+        #     ! C Note. The angle of emission IN PLANE is the same as the one used
+        #     ! C before. This will give rise to a source curved along the orbit.
+        #     ! C The elevation angle is instead characteristic of the SR distribution.
+        #     ! C The electron beam emittance is included at this stage. Note that if
+        #     ! C EPSI = 0, we'll have E_BEAM = 0.0, with no changes.
+        #     ! C
+        #     IF (F_WIGGLER.EQ.3) ANGLE=0        ! Elliptical Wiggler.
+        #     ANGLEX =   ANGLE + E_BEAM(1)
+        #     DIREC(1)  =   TAN(ANGLEX)
+        #     IF (R_ALADDIN.LT.0.0D0) DIREC(1) = - DIREC(1)
+        #     DIREC(2)  =   1.0D0
+        #     ARG_ANG  =   GRID(6,ITIK)
+
+        ANGLEX = ANGLE + E_BEAM1
+        DIREC1 = numpy.tan(ANGLEX)
+        DIREC2 = numpy.ones(NRAYS)
+
+
+        #     ! C
+        #     ! C In the case of SR, we take into account the fact that the electron
+        #     ! C trajectory is not orthogonal to the field. This will give a correction
+        #     ! C to the photon energy.  We can write it as a correction to the
+        #     ! C magnetic field strength; this will linearly shift the critical energy
+        #     ! C and, with it, the energy of the emitted photon.
+        #     ! C
+        #     E_TEMP(3) =   TAN(E_BEAM(3))/COS(E_BEAM(1))
+        #     E_TEMP(2) =   1.0D0
+        #     E_TEMP(1) =   TAN(E_BEAM(1))
+        #     CALL NORM (E_TEMP,E_TEMP)
+        #     CORREC =   SQRT(1.0D0-E_TEMP(3)**2)
+        #     4400 CONTINUE
+        #     (CORREC is not used: the photon energy is sampled from the wiggler spectrum)
+
+
+        #     IF (FDISTR.EQ.6) THEN
+        #         CALL ALADDIN1 (ARG_ANG,ANGLEV,F_POL,IER)
+        #         Q_WAVE =   TWOPI*PHOTON(1)/TOCM*CORREC
+        #         POL_DEG =   ARG_ANG
+        #     ELSE IF (FDISTR.EQ.4) THEN
+        #         ARG_ENER =   WRAN (ISTAR1)
+        #         RAD_MIN =   ABS(R_MAGNET)
+        #
+        #         i1 = 1
+        #         CALL WHITE  &
+        #         (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
+        #     END IF
 
-            direc_norm = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
+        RAD_MIN = numpy.abs(R_MAGNET)
 
-            DIREC1 /= direc_norm
-            DIREC2 /= direc_norm
-            DIREC3 /= direc_norm
+        # CALL WHITE (RAD_MIN,CORREC,ARG_ENER,ARG_ANG,Q_WAVE,ANGLEV,POL_DEG,i1)
+        ARG_ENER = numpy.random.random(NRAYS)
 
-            rays[itik,3] = DIREC1 # VX
-            rays[itik,4] = DIREC2 # VY
-            rays[itik,5] = DIREC3 # VZ
+        critical_energy = TOANGS * 3.0 * numpy.power(gamma, 3) / 4.0 / numpy.pi / 1.0e10 * (1.0 / RAD_MIN)
+        eene = sampled_energies / critical_energy
+
+        sampled_theta, sampled_pol_deg = self.__sample_vertical_angle_and_polarization(
+                                                                eene, a * 1e-3, ARG_ENER,
+                                                                gamma=syned_electron_beam.gamma(),
+                                                                cte=a8 * syned_electron_beam._current * hdiv_mrad * syned_electron_beam._energy_in_GeV ** 2)
+
+        ANGLEV = sampled_theta
+        ANGLEV += E_BEAM3
+        #     IF (ANGLEV.LT.0.0) I_CHANGE = -1
+        #     ANGLEV =   ANGLEV + E_BEAM(3)
+        #     ! C
+        #     ! C Test if the ray is within the specified limits
+        #     ! C
+        #     IF (FGRID.EQ.0.OR.FGRID.EQ.2) THEN
+        #         IF (ANGLEV.GT.VDIV1.OR.ANGLEV.LT.-VDIV2) THEN
+        #             ARG_ANG = WRAN(ISTAR1)
+        #             ! C
+        #             ! C If it is outside the range, then generate another ray.
+        #             ! C
+        #             GO TO 4400
+        #         END IF
+        #     END IF
+        #     DIREC(3)  =   TAN(ANGLEV)/COS(ANGLEX)
+
+        DIREC3 = numpy.tan(ANGLEV) / numpy.cos(ANGLEX)
+        #     IF (F_WIGGLER.EQ.3) THEN
+        #         CALL ROTATE (DIREC, ANGLE3,ANGLE2,ANGLE1,DIREC)
+        #     END IF
+        #     CALL NORM (DIREC,DIREC)
+
+        direc_norm = numpy.sqrt(DIREC1**2 + DIREC2**2 + DIREC3**2)
+
+        rays[:,3] = DIREC1 / direc_norm # VX
+        rays[:,4] = DIREC2 / direc_norm # VY
+        rays[:,5] = DIREC3 / direc_norm # VZ
 
         if user_unit_to_m != 1.0:
             rays[:,0] /= user_unit_to_m
@@ -849,6 +753,74 @@ class S4WigglerLightSource(LightSource, S4LightSource):
 
         return rays
 
+    @classmethod
+    def __sample_vertical_angle_and_polarization(cls, eene, angle, random_in_0_1, gamma=1.0, cte=1.0, chunk_size=2000000):
+        """
+        Samples the vertical emission angle of each ray (inverse method, like Sampler1D.get_sampled) and
+        interpolates its degree of polarization, using the synchrotron angular distribution at the reduced
+        photon energy of the ray.
+
+        :param eene: array (NRAYS) with the reduced photon energies E/Ec.
+        :param angle: array (NPOINTS) with the (equidistant) vertical angles in rad.
+        :param random_in_0_1: array (NRAYS) with uniform random numbers in [0,1].
+        :param gamma: the electron Lorentz factor.
+        :param cte: scaling factor of the angular distributions.
+        :param chunk_size: maximum number of values (rays x angles) evaluated at once.
+        :return: (sampled_theta, sampled_pol_deg), arrays (NRAYS).
+        """
+        nrays = eene.size
+        npoints = angle.size
+        delta_angle = angle[1] - angle[0]
+
+        sampled_theta = numpy.zeros(nrays)
+        sampled_pol_deg = numpy.zeros(nrays)
+
+        step = max(1, chunk_size // npoints)
+        for i0 in range(0, nrays, step):
+            i1 = min(i0 + step, nrays)
+            rows = numpy.arange(i1 - i0)
+
+            fm_s, fm_p = sync_f_sigma_and_pi(angle[numpy.newaxis, :] * gamma, eene[i0:i1, numpy.newaxis])
+            fm_s *= cte * eene[i0:i1, numpy.newaxis] ** 2
+            fm_p *= cte * eene[i0:i1, numpy.newaxis] ** 2
+            fm = fm_s + fm_p
+
+            fm_pol = numpy.zeros_like(fm)
+            non_zero = fm != 0.0
+            fm_pol[non_zero] = fm_s[non_zero] / fm[non_zero]
+
+            # cdf of each ray
+            cdf = numpy.cumsum(fm, axis=1)
+            cdf -= cdf[:, 0:1]
+            cdf_max = cdf[:, -1:].copy()
+            cdf_max[cdf_max == 0.0] = 1.0
+            cdf /= cdf_max
+
+            u = random_in_0_1[i0:i1]
+            ix = (cdf < u[:, numpy.newaxis]).sum(axis=1)
+            ix[ix == npoints] = 0
+            ix[ix > 0] -= 1
+            ix1 = numpy.minimum(ix + 1, npoints - 1)
+            pendent = cdf[rows, ix1] - cdf[rows, ix]
+            delta = numpy.zeros(i1 - i0)
+            good = pendent != 0.0
+            delta[good] = (u[good] - cdf[rows, ix][good]) / pendent[good]
+            theta = angle[ix] + delta * delta_angle
+
+            flat = fm.min(axis=1) == fm.max(axis=1)
+            if flat.any():
+                print("Warning: cannot compute divergence for %d rays" % flat.sum())
+                theta[flat] = 0.0
+
+            # linear interpolation of the polarization at the sampled angle
+            position = (theta - angle[0]) / delta_angle
+            j = numpy.clip(numpy.floor(position).astype(int), 0, npoints - 2)
+            f = position - j
+            sampled_pol_deg[i0:i1] = fm_pol[rows, j] * (1.0 - f) + fm_pol[rows, j + 1] * f
+            sampled_theta[i0:i1] = theta
+
+        return sampled_theta, sampled_pol_deg
+
     def _cross(self,u,v):
         # w = u X v
         # u = array (npoints,vector_index)
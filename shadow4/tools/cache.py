@@ -0,0 +1,117 @@
+"""
+Small process-wide caches used to avoid re-reading files and re-building interpolators
+when the same beamline is traced many times.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy
+
+class LRUCache(object):
+    """
+    Thread-safe dictionary-like cache that keeps at most max_items entries. When full, the
+    least recently used entry is evicted.
+    """
+    def __init__(self, max_items=10):
+        self._max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+                return self._items[key]
+            except KeyError:
+                return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def get_or_create(self, key, creator):
+        """
+        Returns the cached value for key, or calls creator() to build it and stores the result.
+        """
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+                return self._items[key]
+            except KeyError:
+                value = creator()
+                self.put(key, value)
+                return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """
+        Removes all the entries whose key verifies predicate(key).
+        """
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def set_max_items(self, max_items):
+        with self._lock:
+            self._max_items = max_items
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def get_max_items(self):
+        return self._max_items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+def file_key(filename):
+    """
+    Returns a key that identifies the current version of a file (absolute path, modification time and size).
+    """
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+#
+# cache of parsed preprocessor and user files (reflectivity tables, prerefl files, ...), shared by
+# all the optical elements of the process.
+#
+PREPROCESSOR_FILES_CACHE = LRUCache(max_items=20)
+
+def load_cached(filename, loader, cache=PREPROCESSOR_FILES_CACHE):
+    """
+    Returns loader(filename). The file is only read again if it was modified since the last call
+    (or if the entry was evicted from the cache). The returned object is shared, it must not be modified.
+    """
+    key = (loader.__module__, loader.__qualname__) + file_key(filename)
+    return cache.get_or_create(key, lambda: loader(filename))
+
+def load_table(filename, cache=PREPROCESSOR_FILES_CACHE):
+    """
+    Cached version of numpy.loadtxt(filename). The returned array is read-only.
+    """
+    return load_cached(filename, _loadtxt_read_only, cache=cache)
+
+def invalidate_file(filename, cache=PREPROCESSOR_FILES_CACHE):
+    """
+    Removes from the cache all the entries loaded from filename.
+    """
+    path = os.path.abspath(filename)
+    cache.invalidate_if(lambda key: key[2] == path)
+
+def _loadtxt_read_only(filename):
+    values = numpy.loadtxt(filename)
+    values.setflags(write=False)
+    return values
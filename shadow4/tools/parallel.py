@@ -0,0 +1,38 @@
+"""
+Helpers to distribute independent calculations (e.g. the photon energies of the undulator radiation)
+on several processes.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+def get_number_of_workers(number_of_workers=1):
+    """
+    Returns the number of processes to use: number_of_workers, or the number of cpus if it is None or <= 0.
+    """
+    if number_of_workers is None or number_of_workers <= 0:
+        return os.cpu_count() or 1
+    return int(number_of_workers)
+
+def split_indices(n, number_of_slices):
+    """
+    Splits range(n) in (at most) number_of_slices contiguous slices of similar size.
+    """
+    return [(int(indices[0]), int(indices[-1]) + 1) for indices in numpy.array_split(numpy.arange(n), max(1, min(n, number_of_slices)))
+            if indices.size > 0]
+
+def map_in_processes(function, arguments_list, number_of_workers=1):
+    """
+    Returns [function(*arguments) for arguments in arguments_list]. If number_of_workers > 1 the calls are
+    distributed in a pool of processes (function and arguments must be picklable). The results are
+    always returned in the order of arguments_list.
+    """
+    number_of_workers = min(get_number_of_workers(number_of_workers), len(arguments_list))
+
+    if number_of_workers <= 1:
+        return [function(*arguments) for arguments in arguments_list]
+
+    with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+        futures = [executor.submit(function, *arguments) for arguments in arguments_list]
+        return [future.result() for future in futures]